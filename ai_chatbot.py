@@ -1,16 +1,651 @@
-import google.generativeai as genai
+import asyncio
+import concurrent.futures
+import hashlib
+import itertools
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+from query_parser import CONFIDENCE_THRESHOLD, parse_query
+
+MODEL_NAME = 'gemini-1.5-flash'
+
+# Seconds a cached response stays fresh, per kind of request. Translations
+# rarely change; recommendations depend on menus that change over time.
+CACHE_TTLS = {
+    'search_restaurants': 10 * 60,
+    'search_menu_items': 10 * 60,
+    'translate_request': 7 * 24 * 60 * 60,
+    'chat': 5 * 60,
+}
+DEFAULT_CACHE_TTL = 5 * 60
+
+RESPONSE_CACHE_PATH = 'response_cache.db'
+RESPONSE_CACHE_ENTRIES = 1024
+# Row cap of the SQLite tier, and how many writes pass between sweeps
+# that drop expired rows and then the rows closest to expiring
+RESPONSE_CACHE_DISK_ENTRIES = 20000
+RESPONSE_CACHE_SWEEP_EVERY = 100
+
+# Upper bound on Gemini requests in flight across all sessions
+MAX_CONCURRENT_REQUESTS = 8
+
+# Default number of tokens of menu data packed into a single prompt
+CONTEXT_TOKEN_BUDGET = 1500
+
+# Dishes kept, by similarity to the request, before packing a long menu
+SEMANTIC_TOP_K = 20
+
+# Default number of tokens of earlier conversation sent with a chat message
+HISTORY_TOKEN_BUDGET = 500
+
+# Gemini quota for the whole process: steady requests per minute plus the
+# burst allowed on top, and the longest a request queues for its turn
+REQUESTS_PER_MINUTE = 60
+RATE_LIMIT_BURST = 10
+MAX_QUEUE_WAIT = 20
+
+# Seconds a single attempt may take, and a whole call including retries
+REQUEST_TIMEOUT = 30
+TOTAL_TIMEOUT = 90
+
+# Rate-limited (429) and server (5xx) errors are retried with full-jitter
+# exponential backoff, so many sessions retrying do not hit the quota in
+# lockstep
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8
+
+# Consecutive failures that open the circuit, and seconds until one trial
+# request is let through again
+BREAKER_FAILURES = 5
+BREAKER_RESET = 30
+
+FALLBACK_INTRO = "Our assistant is busy right now, but these dishes match your request:"
+FALLBACK_EMPTY = "Our assistant is busy right now. Please try again in a minute."
+
+
+def estimate_tokens(text):
+    """Rough token count: ~4 Latin characters per token, ~1 token per CJK/Tamil character"""
+    non_ascii = sum(1 for char in text if ord(char) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii + 1
+
+
+def build_menu_context(dishes, query='', min_price=None, max_price=None, exclude=(),
+                       token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Pack the dishes most relevant to a request into a compact table
+    `dishes` is an iterable of dicts with 'name' and 'price' (SGD) and
+    optionally 'restaurant', 'description' and 'rating'. Dishes outside
+    the price range or containing an excluded restriction (see
+    dietary.filter_dishes) are dropped; the rest are ranked by how many
+    query words they contain, then rating, then price, and added until
+    the token budget is used up.
+    """
+    if exclude:
+        from dietary import filter_dishes
+        dishes = filter_dishes(dishes, exclude)
+    query_words = set(re.findall(r'\w+', query.lower()))
+
+    candidates = []
+    for dish in dishes:
+        price = dish['price']
+        if (min_price is not None and price < min_price) or (max_price is not None and price > max_price):
+            continue
+        text = f"{dish['name']} {dish.get('description') or ''}".lower()
+        matches = len(query_words.intersection(re.findall(r'\w+', text)))
+        candidates.append((-matches, -(dish.get('rating') or 0), price, dish))
+    candidates.sort(key=lambda candidate: candidate[:3])
+
+    lines = ['Restaurant | Dish | Price']
+    used = estimate_tokens(lines[0])
+    for _, _, price, dish in candidates:
+        line = f"{dish.get('restaurant', '')} | {dish['name']} | ${price:.2f}"
+        if dish.get('description'):
+            line += f" | {dish['description'][:60]}"
+        cost = estimate_tokens(line)
+        if used + cost > token_budget:
+            break
+        lines.append(line)
+        used += cost
+    if len(lines) == 1:
+        return 'No matching dishes'
+    return '\n'.join(lines)
+
+
+def build_history_context(turns, summary='', token_budget=HISTORY_TOKEN_BUDGET):
+    """
+    Pack the most recent turns of a conversation into a bounded context
+    `turns` are dicts with 'user' and 'bot', newest first (as returned by
+    Database.chat_history). Turns are added until the token budget is
+    used up, then listed oldest first; the summary of older turns is
+    included if it still fits.
+    """
+    lines = []
+    used = 0
+    for turn in turns:
+        bot = ' '.join(turn['bot'].split())
+        text = f"User: {turn['user']}\nAssistant: {bot[:300]}"
+        cost = estimate_tokens(text)
+        if used + cost > token_budget:
+            break
+        lines.append(text)
+        used += cost
+    lines.reverse()
+    if summary:
+        summary = f"Earlier requests: {summary}"
+        if used + estimate_tokens(summary) <= token_budget:
+            lines.insert(0, summary)
+    return '\n'.join(lines)
+
+
+def local_recommendations(menu_context, limit=10):
+    """
+    Answer a search without the model, from a build_menu_context table
+    Used when Gemini is unavailable; returns FALLBACK_EMPTY if the
+    context has no dishes.
+    """
+    lines = menu_context.split('\n')
+    if lines[0] != 'Restaurant | Dish | Price' or len(lines) == 1:
+        return FALLBACK_EMPTY
+    return FALLBACK_INTRO + '\n' + '\n'.join(f"- {line}" for line in lines[1:limit + 1])
+
+
+class ModelUnavailable(RuntimeError):
+    """Gemini cannot answer: the circuit is open, the quota queue is full, or retries ran out"""
+
+
+class TokenBucket:
+    """Thread-safe token-bucket rate limiter"""
+
+    def __init__(self, per_minute=REQUESTS_PER_MINUTE, burst=RATE_LIMIT_BURST):
+        self.rate = per_minute / 60
+        self.capacity = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait=MAX_QUEUE_WAIT):
+        """
+        Take a token and return how many seconds to wait before using it
+        Raises ModelUnavailable instead of queueing longer than max_wait.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait > max_wait:
+                metrics.increment('llm_rate_limited_total')
+                raise ModelUnavailable('Too many requests are waiting for the model')
+            # Tokens may go negative; later callers then queue behind this one
+            self._tokens -= 1
+            return wait
+
+
+class CircuitBreaker:
+    """
+    Fails fast while the model is unhealthy
+    After `failures` consecutive failures the circuit opens for
+    `reset_after` seconds; then a single trial call is let through, and
+    its result closes or re-opens the circuit.
+    """
+
+    def __init__(self, failures=BREAKER_FAILURES, reset_after=BREAKER_RESET):
+        self.failures = failures
+        self.reset_after = reset_after
+        self._count = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            return 'open' if time.monotonic() - self._opened_at < self.reset_after else 'half-open'
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_after or self._trial:
+                return False
+            self._trial = True
+            return True
+
+    def release_trial(self):
+        """Give back the trial call's slot when it ends without a result, e.g. cancelled or never sent"""
+        with self._lock:
+            self._trial = False
+
+    def record_success(self):
+        with self._lock:
+            self._count = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._count += 1
+            self._trial = False
+            if self._opened_at is not None or self._count >= self.failures:
+                if self._opened_at is None:
+                    metrics.increment('llm_circuit_opened_total')
+                self._opened_at = time.monotonic()
+
+
+def _is_retryable(error):
+    # google.api_core errors carry the HTTP status in `code`
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    return getattr(error, 'code', None) in RETRYABLE_STATUS
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff before retry number `attempt` (0-based)"""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+# One quota for every model and session in the process
+RATE_LIMITER = TokenBucket()
+
+
+class ResponseCache:
+    """
+    Cache of model responses keyed by normalized prompt, model and language
+    Entries live in an in-memory LRU and, when db_path is set, in a SQLite
+    table shared by every process using the same file. Each entry has its
+    own TTL.
+    """
+
+    def __init__(self, max_entries=RESPONSE_CACHE_ENTRIES, db_path=None,
+                 max_disk_entries=RESPONSE_CACHE_DISK_ENTRIES, sweep_every=RESPONSE_CACHE_SWEEP_EVERY):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self.max_disk_entries = max_disk_entries
+        self.sweep_every = sweep_every
+        self._entries = OrderedDict()  # key -> (expires_at, text)
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if db_path:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute('''CREATE TABLE IF NOT EXISTS response_cache (
+                                        key TEXT PRIMARY KEY,
+                                        response TEXT NOT NULL,
+                                        expires_at REAL NOT NULL);''')
+                    conn.execute('CREATE INDEX IF NOT EXISTS idx_response_cache_expires '
+                                 'ON response_cache(expires_at);')
+                    self._sweep(conn)
+            finally:
+                conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    @staticmethod
+    def make_key(prompt, model_name, language='english'):
+        # Case and whitespace differences should not cause a miss
+        normalized = ' '.join(prompt.lower().split())
+        return hashlib.sha256(f'{model_name}\0{language}\0{normalized}'.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        if self.db_path:
+            conn = self._connect()
+            try:
+                row = conn.execute('SELECT response, expires_at FROM response_cache WHERE key = ? AND expires_at > ?',
+                                   (key, now)).fetchone()
+            finally:
+                conn.close()
+            if row is not None:
+                self._remember(key, row[0], row[1])
+                with self._lock:
+                    self.disk_hits += 1
+                return row[0]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _remember(self, key, text, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, key, text, ttl=DEFAULT_CACHE_TTL):
+        expires_at = time.time() + ttl
+        self._remember(key, text, expires_at)
+        if self.db_path:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute('INSERT OR REPLACE INTO response_cache (key, response, expires_at) VALUES (?, ?, ?)',
+                                 (key, text, expires_at))
+                    with self._lock:
+                        self._writes += 1
+                        sweep = self._writes % self.sweep_every == 0
+                    if sweep:
+                        self._sweep(conn)
+            finally:
+                conn.close()
+
+    def _sweep(self, conn):
+        # Long-running processes would otherwise only clean up at startup
+        conn.execute('DELETE FROM response_cache WHERE expires_at < ?', (time.time(),))
+        conn.execute('''DELETE FROM response_cache WHERE key IN (
+                            SELECT key FROM response_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)''',
+                     (self.max_disk_entries,))
+
+    def stats(self):
+        """Return hit/miss counters for measuring latency and quota saved"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': hits / total if total else 0.0,
+                'entries': len(self._entries),
+            }
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def shared_cache():
+    """Return the process-wide response cache, backed by RESPONSE_CACHE_PATH"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = ResponseCache(db_path=RESPONSE_CACHE_PATH)
+        return _shared_cache
+
+
+class AsyncGeminiClient:
+    """
+    Runs Gemini requests on a background asyncio loop shared by all sessions
+    At most max_concurrency requests are in flight at once, and callers
+    asking for a key that is already in flight await the same request
+    instead of sending a duplicate. Requests are rate limited, retried with
+    backoff and guarded by a circuit breaker; when the model cannot answer
+    ModelUnavailable is raised.
+    """
+
+    def __init__(self, model, max_concurrency=MAX_CONCURRENT_REQUESTS, limiter=None, breaker=None,
+                 request_timeout=REQUEST_TIMEOUT):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.limiter = limiter if limiter is not None else RATE_LIMITER
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.request_timeout = request_timeout
+        self._semaphore = None
+        self._in_flight = {}  # key -> asyncio.Task, only touched on the loop
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='gemini-client', daemon=True)
+        self._thread.start()
+
+    def before_attempt(self):
+        """
+        Check the circuit and take a rate-limit token; return the seconds to wait first
+        If no token is available the trial slot of a half-open circuit is
+        released, so a later call can still close the circuit.
+        """
+        if not self.breaker.allow():
+            raise ModelUnavailable('The model is unavailable after repeated errors')
+        try:
+            return self.limiter.reserve()
+        except BaseException:
+            self.breaker.release_trial()
+            raise
+
+    def attempt_failed(self, error, attempt):
+        """
+        Record a failed attempt and return the backoff before the next one
+        Errors that retrying cannot fix are re-raised; ModelUnavailable is
+        raised once MAX_RETRIES retries have failed.
+        """
+        if not _is_retryable(error):
+            # The model answered; the request itself was at fault
+            self.breaker.record_success()
+            raise error
+        self.breaker.record_failure()
+        if attempt >= MAX_RETRIES:
+            raise ModelUnavailable(f'The model failed {attempt + 1} times ({type(error).__name__}: {error})') \
+                from error
+        metrics.increment('llm_retries_total', error=type(error).__name__)
+        return backoff_delay(attempt)
+
+    async def _request(self, prompt):
+        if self._semaphore is None:
+            # Created lazily so it belongs to the client's loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        metrics.observe('llm_prompt_tokens', estimate_tokens(prompt), metrics.SIZE_BUCKETS)
+        for attempt in itertools.count():
+            wait = self.before_attempt()
+            try:
+                await asyncio.sleep(wait)
+                async with self._semaphore:
+                    with metrics.timer('llm_request', mode='async'):
+                        response = await asyncio.wait_for(
+                            self.model.generate_content_async(
+                                prompt, request_options={'timeout': self.request_timeout}),
+                            self.request_timeout)
+                        text = response.text
+            except asyncio.CancelledError:
+                # Neither a success nor a failure of the model
+                self.breaker.release_trial()
+                raise
+            except Exception as e:
+                # Backoff happens outside the semaphore so others can proceed
+                await asyncio.sleep(self.attempt_failed(e, attempt))
+                continue
+            self.breaker.record_success()
+            metrics.observe('llm_response_tokens', estimate_tokens(text), metrics.SIZE_BUCKETS)
+            return text
+
+    async def _generate(self, prompt, key):
+        task = self._in_flight.get(key)
+        if task is None:
+            task = self._loop.create_task(self._request(prompt))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # Shield so one caller cancelling does not cancel the shared request
+        return await asyncio.shield(task)
+
+    def run(self, coroutine, timeout=TOTAL_TIMEOUT):
+        """
+        Run a coroutine on the client's loop and wait for its result
+        Raises ModelUnavailable if it takes longer than `timeout` seconds.
+        """
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise ModelUnavailable(f'No answer from the model within {timeout} seconds')
+
+    async def agenerate(self, prompt, key=None):
+        """Generate a response; usable from any event loop"""
+        if key is None:
+            key = prompt
+        coroutine = self._generate(prompt, key)
+        if asyncio.get_running_loop() is self._loop:
+            return await coroutine
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, self._loop))
+
+    def generate(self, prompt, key=None, timeout=TOTAL_TIMEOUT):
+        """Generate a response from synchronous code, e.g. a Streamlit script thread"""
+        return self.run(self.agenerate(prompt, key), timeout)
+
+    def generate_many(self, prompts, timeout=TOTAL_TIMEOUT):
+        """Generate responses for several prompts concurrently, in input order"""
+        async def gather():
+            return await asyncio.gather(*(self.agenerate(prompt) for prompt in prompts))
+        return self.run(gather(), timeout)
+
+
+_shared_clients = {}
+_shared_clients_lock = threading.Lock()
+
+
+def _bind_key(client, api_key):
+    # genai.configure holds one process-wide key, which a GenerativeModel
+    # picks up on its first request, so with every user typing their own
+    # key all models would run under whichever came first. The model gets
+    # clients of its own, made with its key, instead.
+    try:
+        import google.ai.generativelanguage as glm
+    except ImportError:
+        return  # a stand-in for the SDK, as in benchmark.py
+    options = {'api_key': api_key}
+    client.model._client = glm.GenerativeServiceClient(client_options=options)
+
+    async def bind_async():
+        # gRPC asyncio channels belong to the loop they are created on
+        client.model._async_client = glm.GenerativeServiceAsyncClient(client_options=options)
+    client.run(bind_async())
+
+
+def shared_client(api_key, model_name=MODEL_NAME):
+    """Return the process-wide AsyncGeminiClient for an API key and model"""
+    import google.generativeai as genai
+    with _shared_clients_lock:
+        if (api_key, model_name) not in _shared_clients:
+            client = AsyncGeminiClient(genai.GenerativeModel(model_name))
+            _bind_key(client, api_key)
+            _shared_clients[api_key, model_name] = client
+        return _shared_clients[api_key, model_name]
+
 
 class AIChatbot:
-    def __init__(self, api_key):
-        genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel('gemini-1.5-flash')
-        
-    def search_restaurants(self, user_request, restaurants_data, language='english'):
+    def __init__(self, api_key, model_name=MODEL_NAME, cache=None):
+        self.model_name = model_name
+        self.cache = cache if cache is not None else shared_cache()
+        self.client = shared_client(api_key, model_name)
+        # Streams are read synchronously through the same keyed model
+        self.model = self.client.model
+
+    def generate(self, prompt, kind='chat', language='english', fallback=None):
         """
-        Use AI to search for restaurants based on user request
-        Considers dietary restrictions and price preferences
+        Return the model's response to a prompt, served from the cache
+        when the same prompt was answered recently. `kind` selects the TTL
+        from CACHE_TTLS. If the model is unavailable, fallback() is
+        returned when given, otherwise ModelUnavailable is raised.
         """
-        prompt = f"""
+        try:
+            return self.client.run(self.agenerate(prompt, kind, language, fallback))
+        except ModelUnavailable:
+            if fallback is None:
+                raise
+            metrics.increment('llm_fallback_total', kind=kind)
+            return fallback()
+
+    async def agenerate(self, prompt, kind='chat', language='english', fallback=None):
+        """Async version of generate; identical prompts in flight share one request"""
+        key = self.cache.make_key(prompt, self.model_name, language)
+        text = self.cache.get(key)
+        metrics.increment('llm_cache_total', kind=kind, result='miss' if text is None else 'hit')
+        if text is None:
+            try:
+                text = await self.client.agenerate(prompt, key)
+            except ModelUnavailable:
+                if fallback is None:
+                    raise
+                # Fallback answers are not cached, so the model is asked
+                # again once it recovers
+                metrics.increment('llm_fallback_total', kind=kind)
+                return fallback()
+            self.cache.put(key, text, CACHE_TTLS.get(kind, DEFAULT_CACHE_TTL))
+        return text
+
+    def stream(self, prompt, kind='chat', language='english'):
+        """
+        Yield the response to a prompt in chunks as the model produces them
+        A cached response is yielded as one chunk; a new response is only
+        cached once the stream has completed. Raises ModelUnavailable if
+        the model cannot answer or the stream breaks off.
+        """
+        key = self.cache.make_key(prompt, self.model_name, language)
+        text = self.cache.get(key)
+        metrics.increment('llm_cache_total', kind=kind, result='miss' if text is None else 'hit')
+        if text is not None:
+            yield text
+            return
+        metrics.observe('llm_prompt_tokens', estimate_tokens(prompt), metrics.SIZE_BUCKETS)
+        chunks = []
+        start = time.perf_counter()
+        # Time to first chunk is what the user waits for; the timer covers
+        # the whole stream, including time the caller spends rendering
+        with metrics.timer('llm_request', mode='stream'):
+            response = self._open_stream(prompt)
+            metrics.observe('llm_first_chunk_seconds', time.perf_counter() - start)
+            try:
+                for chunk in response:
+                    chunks.append(chunk.text)
+                    yield chunk.text
+            except Exception as e:
+                self.client.breaker.record_failure()
+                raise ModelUnavailable(f'The answer was interrupted: {e}') from e
+        metrics.observe('llm_response_tokens', estimate_tokens(''.join(chunks)), metrics.SIZE_BUCKETS)
+        self.cache.put(key, ''.join(chunks), CACHE_TTLS.get(kind, DEFAULT_CACHE_TTL))
+
+    def _open_stream(self, prompt):
+        # Retries happen only until the first chunk arrives; a stream that
+        # breaks later cannot be retried without repeating text already shown
+        for attempt in itertools.count():
+            wait = self.client.before_attempt()
+            try:
+                time.sleep(wait)
+                response = iter(self.model.generate_content(
+                    prompt, stream=True, request_options={'timeout': self.client.request_timeout}))
+                first = next(response, None)
+            except Exception as e:
+                time.sleep(self.client.attempt_failed(e, attempt))
+                continue
+            except BaseException:
+                self.client.breaker.release_trial()
+                raise
+            self.client.breaker.record_success()
+            return itertools.chain([first] if first is not None else [], response)
+
+    def run_batch(self, *coroutines, timeout=TOTAL_TIMEOUT):
+        """
+        Run several async calls concurrently from synchronous code
+        e.g. chatbot.run_batch(chatbot.atranslate_request(text),
+                               chatbot.asearch_menu_items(text, menu_data))
+        Returns the results in the order given.
+        """
+        async def gather():
+            return await asyncio.gather(*coroutines)
+        return self.client.run(gather(), timeout)
+    
+    def _restaurants_prompt(self, user_request, restaurants_data, language):
+        return f"""
         User request: {user_request}
         Language: {language}
         
@@ -26,15 +661,9 @@ class AIChatbot:
         
         Provide a clear recommendation with restaurant name, dish, price, and reason.
         """
-        
-        response = self.model.generate_content(prompt)
-        return response.text
     
-    def search_menu_items(self, user_request, menu_data, language='english'):
-        """
-        Use AI to search for specific items in uploaded menus
-        """
-        prompt = f"""
+    def _menu_items_prompt(self, user_request, menu_data, language):
+        return f"""
         User request: {user_request}
         Language: {language}
         
@@ -45,16 +674,9 @@ class AIChatbot:
         Consider dietary restrictions and price preferences if mentioned.
         Provide dish name, description, and price.
         """
-        
-        response = self.model.generate_content(prompt)
-        return response.text
     
-    def translate_request(self, text, target_language='english'):
-        """
-        Translate user input to English for processing
-        Supports: English, Chinese, Malay, Tamil
-        """
-        prompt = f"""
+    def _translate_prompt(self, text, target_language):
+        return f"""
         Translate the following text to English.
         Original language may be: English, Chinese, Malay, or Tamil.
         
@@ -62,15 +684,9 @@ class AIChatbot:
         
         Provide only the English translation.
         """
-        
-        response = self.model.generate_content(prompt)
-        return response.text
     
-    def chat(self, user_message, context=""):
-        """
-        General chat functionality for the senior citizen
-        """
-        prompt = f"""
+    def _chat_prompt(self, user_message, context):
+        return f"""
         You are a helpful assistant for senior citizens in Singapore using GRAB delivery service.
         Be polite, clear, and use simple language.
         
@@ -79,6 +695,110 @@ class AIChatbot:
         
         Provide a helpful response.
         """
-        
-        response = self.model.generate_content(prompt)
-        return response.text
\ No newline at end of file
+    
+    def _menu_context(self, user_request, menu_data, context_options):
+        # Lists of dish dicts lose excluded dishes first, so the model never
+        # sees them, then are narrowed to the top_k dishes closest to the
+        # request in meaning and packed into the token budget;
+        # pre-formatted strings are passed through unchanged
+        if isinstance(menu_data, str):
+            return menu_data
+        options = dict(context_options)
+        top_k = options.pop('top_k', SEMANTIC_TOP_K)
+        if options.get('exclude'):
+            from dietary import filter_dishes
+            menu_data = filter_dishes(menu_data, options.pop('exclude'))
+        if len(menu_data) > top_k:
+            from vector_index import rank_dishes
+            menu_data = rank_dishes(user_request, menu_data, top_k, min_price=options.get('min_price'),
+                                    max_price=options.get('max_price'))
+        return build_menu_context(menu_data, user_request, **options)
+    
+    def search_restaurants(self, user_request, restaurants_data, language='english', **context_options):
+        """
+        Use AI to search for restaurants based on user request
+        Considers dietary restrictions and price preferences
+        `restaurants_data` may be a string or a list of dish dicts, which
+        is narrowed to the `top_k` most similar dishes and packed with
+        build_menu_context using `context_options` (top_k, min_price,
+        max_price, exclude, token_budget). When the model is
+        unavailable the packed dishes are listed without it.
+        """
+        restaurants_data = self._menu_context(user_request, restaurants_data, context_options)
+        prompt = self._restaurants_prompt(user_request, restaurants_data, language)
+        return self.generate(prompt, 'search_restaurants', language,
+                             fallback=lambda: local_recommendations(restaurants_data))
+    
+    async def asearch_restaurants(self, user_request, restaurants_data, language='english', **context_options):
+        """Async version of search_restaurants"""
+        restaurants_data = self._menu_context(user_request, restaurants_data, context_options)
+        prompt = self._restaurants_prompt(user_request, restaurants_data, language)
+        return await self.agenerate(prompt, 'search_restaurants', language,
+                                    fallback=lambda: local_recommendations(restaurants_data))
+    
+    def search_menu_items(self, user_request, menu_data, language='english', **context_options):
+        """
+        Use AI to search for specific items in uploaded menus
+        `menu_data` is handled as in search_restaurants
+        """
+        menu_data = self._menu_context(user_request, menu_data, context_options)
+        prompt = self._menu_items_prompt(user_request, menu_data, language)
+        return self.generate(prompt, 'search_menu_items', language,
+                             fallback=lambda: local_recommendations(menu_data))
+    
+    async def asearch_menu_items(self, user_request, menu_data, language='english', **context_options):
+        """Async version of search_menu_items"""
+        menu_data = self._menu_context(user_request, menu_data, context_options)
+        prompt = self._menu_items_prompt(user_request, menu_data, language)
+        return await self.agenerate(prompt, 'search_menu_items', language,
+                                    fallback=lambda: local_recommendations(menu_data))
+    
+    def translate_request(self, text, target_language='english'):
+        """
+        Translate user input to English for processing
+        Supports: English, Chinese, Malay, Tamil
+        The text is returned unchanged when the model is unavailable.
+        """
+        prompt = self._translate_prompt(text, target_language)
+        return self.generate(prompt, 'translate_request', target_language, fallback=lambda: text)
+    
+    async def atranslate_request(self, text, target_language='english'):
+        """Async version of translate_request"""
+        prompt = self._translate_prompt(text, target_language)
+        return await self.agenerate(prompt, 'translate_request', target_language, fallback=lambda: text)
+    
+    def chat(self, user_message, context=""):
+        """
+        General chat functionality for the senior citizen
+        `context` is earlier conversation, e.g. from build_history_context
+        """
+        prompt = self._chat_prompt(user_message, context)
+        return self.generate(prompt, 'chat')
+    
+    def parse_request(self, text):
+        """
+        Pull the dish, price limit and dietary exclusions out of a request
+        The local parser handles all four languages; only requests it
+        cannot understand well are translated by the model and re-parsed.
+        """
+        parsed = parse_query(text)
+        if parsed.confidence >= CONFIDENCE_THRESHOLD or parsed.language == 'english':
+            return parsed
+        try:
+            translated = parse_query(self.translate_request(text))
+        except Exception:
+            # Errors that are not retried (a bad key, a blocked prompt) still
+            # leave the local parse to search with
+            metrics.increment('llm_fallback_total', kind='translate_request')
+            return parsed
+        return translated._replace(language=parsed.language)
+    
+    def chat_stream(self, user_message, context=""):
+        """Streaming version of chat, for st.write_stream"""
+        prompt = self._chat_prompt(user_message, context)
+        return self.stream(prompt, 'chat')
+    
+    async def achat(self, user_message, context=""):
+        """Async version of chat"""
+        prompt = self._chat_prompt(user_message, context)
+        return await self.agenerate(prompt, 'chat')
\ No newline at end of file
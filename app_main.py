@@ -1,8 +1,11 @@
 import streamlit as st
-import google.generativeai as genai
-from database import Database
-from menu_parser import extract_menu_items
+import metrics
+from ai_chatbot import build_menu_context, local_recommendations, shared_cache
+from database import HISTORY_PAGE_SIZE
+from resources import PROGRESS_REFRESH_SECONDS, get_chatbot, get_database, get_job_queue
+from ui_text import LANGUAGES, LARGE_TEXT_CSS
 import os
+import uuid
 
 # Page configuration for senior citizens - large fonts and simple interface
 st.set_page_config(
@@ -13,46 +16,38 @@ st.set_page_config(
 )
 
 # Custom CSS for larger text
-st.markdown("""
-    <style>
-    html, body, [class*="st-"] {
-        font-size: 20px;
-    }
-    h1 {
-        font-size: 48px;
-    }
-    h2 {
-        font-size: 36px;
-    }
-    </style>
-    """, unsafe_allow_html=True)
+st.markdown(LARGE_TEXT_CSS, unsafe_allow_html=True)
 
 # Initialize session state
 if 'restaurants' not in st.session_state:
     st.session_state.restaurants = {}
-if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex[:8]
+if 'history_pages' not in st.session_state:
+    st.session_state.history_pages = [None]  # before_id of each history page visited
+
+# Tag every timed call made during this run with the user's session
+metrics.set_session(st.session_state.session_id)
 
-# Initialize database
-db = Database('grab_helper.db')
+# Initialize database (created once per process, reused on every rerun)
+db = get_database('grab_helper.db')
 
-# Initialize AI chatbot with Google Gemini
+# Search history is stored under a key kept in the page URL, so it
+# survives reloads and restarts for anyone using the same link
+# The key is the only credential for that history, so it is a full
+# random UUID rather than the short session id used to tag metrics;
+# shorter keys from older links are easy to guess and get replaced
+if len(st.query_params.get('user', '')) < 32:
+    st.query_params['user'] = uuid.uuid4().hex
+user_key = st.query_params['user']
+
+# Google Gemini API key; the chatbot (and the Gemini SDK) is only loaded
+# when a page first needs it
 api_key = os.getenv('GOOGLE_API_KEY', 'YOUR_API_KEY_HERE')
-if api_key != 'YOUR_API_KEY_HERE':
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel('gemini-1.5-flash')
-else:
-    model = None
+if api_key == 'YOUR_API_KEY_HERE':
+    api_key = None
     st.warning("⚠️ Please set GOOGLE_API_KEY environment variable")
 
-# Language support
-LANGUAGES = {
-    'English': 'english',
-    '中文 (Chinese)': 'chinese',
-    'Bahasa Melayu': 'malay',
-    'தமிழ் (Tamil)': 'tamil'
-}
-
 # Main title
 st.title("🍽️ GRAB Senior Helper")
 st.subheader("Find Your Favorite Food - Easy to Use!")
@@ -66,7 +61,7 @@ with st.sidebar:
     st.divider()
     st.header("📋 Quick Links")
     page = st.radio("Select an option:", 
-                     ["🏠 Home", "🤖 Food Chatbot", "📄 Upload Menu", "📊 My Orders"])
+                     ["🏠 Home", "🤖 Food Chatbot", "📄 Upload Menu", "📊 My Orders", "🛠️ Admin"])
 
 # HOME PAGE
 if page == "🏠 Home":
@@ -91,13 +86,24 @@ if page == "🏠 Home":
     
     st.divider()
     
+    # Counts are kept up to date by the database as menus are stored, so
+    # reading them costs the same however large the catalogue grows
+    stats = db.catalog_stats()
     col1, col2, col3 = st.columns(3)
     with col1:
-        st.metric("Restaurants", len(st.session_state.restaurants), "+5 new this week")
+        st.metric("Restaurants", stats['restaurants'])
     with col2:
-        st.metric("Menu Items", 250, "+50 new items")
+        st.metric("Menu Items", stats['dishes'])
     with col3:
-        st.metric("Happy Seniors", 1200, "+100 this month")
+        st.metric("Happy Seniors", stats['users'])
+    
+    top_rated = db.top_rated()
+    if top_rated:
+        st.subheader("⭐ Best Rated Restaurants")
+        for restaurant in top_rated:
+            st.write(f"**{restaurant['name']}** - ⭐ {restaurant['rating']:.1f}")
+            st.caption(f"📍 {restaurant['location'] or 'Singapore'} · {restaurant['dishes']} dishes · "
+                       f"about ${restaurant['average_price']:.2f} each")
 
 # FOOD CHATBOT PAGE
 elif page == "🤖 Food Chatbot":
@@ -125,13 +131,29 @@ elif page == "🤖 Food Chatbot":
         )
     
     if st.button("🔍 Search", use_container_width=True):
-        if user_input and model:
+        if user_input and api_key:
+            chatbot = get_chatbot(api_key)
             with st.spinner("Finding the best options for you..."):
+                # The request is parsed locally (any language), so no
+                # translation round trip is needed before searching
+                parsed = chatbot.parse_request(user_input)
+                excluded = [item for item in dietary_restrictions if item != "None"]
+                excluded += [item for item in parsed.exclude if item not in excluded]
+                max_price = min(price_range[1], parsed.max_price or price_range[1])
+                # Narrow the uploaded dishes down locally so the prompt only
+                # carries a handful of matching candidates
+                candidates = db.search_dishes(parsed.dish or user_input, price_range[0], max_price,
+                                              exclude=excluded, limit=50)
+                candidate_text = build_menu_context(candidates, user_input)
+                
                 prompt = f"""
                 User request: {user_input}
                 Language: {language_code}
-                Dietary restrictions to avoid: {', '.join(dietary_restrictions) if dietary_restrictions else 'None'}
-                Price range: ${price_range[0]} - ${price_range[1]} SGD
+                Dietary restrictions to avoid: {', '.join(excluded) if excluded else 'None'}
+                Price range: ${price_range[0]} - ${max_price} SGD
+                
+                Matching dishes from uploaded menus:
+                {candidate_text}
                 
                 Recommend:
                 1. Restaurant name
@@ -141,17 +163,21 @@ elif page == "🤖 Food Chatbot":
                 
                 Format the response in a friendly, encouraging way for a senior citizen.
                 """
-                
-                response = model.generate_content(prompt)
-                st.success("Here are my recommendations:")
-                st.info(response.text)
-                
-                # Add to chat history
-                st.session_state.chat_history.append({
-                    "user": user_input,
-                    "bot": response.text
-                })
-        elif not model:
+            
+            # Show the answer as it is generated instead of after a long wait
+            st.success("Here are my recommendations:")
+            try:
+                response_text = st.write_stream(chatbot.stream(prompt, 'search_menu_items', language_code))
+            except Exception:
+                # Gemini is down or over quota: list the local matches instead
+                metrics.increment('app_errors_total', where='food_chatbot')
+                response_text = local_recommendations(candidate_text)
+                st.info(response_text)
+            
+            # Add to the search history once the full answer has arrived
+            db.add_turn(user_key, user_input, response_text, kind='search')
+            st.session_state.history_pages = [None]
+        elif not api_key:
             st.error("AI model not available. Please set GOOGLE_API_KEY.")
         else:
             st.warning("Please type what you want to eat first!")
@@ -170,41 +196,81 @@ elif page == "📄 Upload Menu":
     uploaded_file = st.file_uploader("Upload Menu (PDF)", type=['pdf'])
     
     if uploaded_file and st.button("📤 Upload Menu", use_container_width=True):
-        with st.spinner("Processing menu..."):
-            # Save uploaded file
-            with open(f"temp_{uploaded_file.name}", "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            
-            # Extract menu items
-            menu_items = extract_menu_items(f"temp_{uploaded_file.name}")
-            
-            st.success(f"✅ Menu uploaded successfully!")
-            st.info(f"Found {len(menu_items)} items in the menu")
-            
-            # Display menu items
-            with st.expander("View Menu Items"):
-                for i, item in enumerate(menu_items[:20], 1):
-                    if item.strip():
+        # Extraction runs in the background, so the page stays responsive
+        # and the upload survives a refresh or a closed tab
+        get_job_queue().submit(
+            uploaded_file.getvalue(),
+            uploaded_file.name,
+            restaurant_name,
+            restaurant_location,
+            restaurant_rating,
+            ocr=False,
+            session=st.session_state.session_id
+        )
+        st.success("✅ Menu received! We are reading it now.")
+    
+    # Progress of this session's recent uploads
+    def show_uploads(polling):
+        jobs = get_job_queue().recent(st.session_state.session_id, 5)
+        if polling != any(job['status'] in ('queued', 'running') for job in jobs):
+            # Rerun the whole page to start or stop the refresh timer
+            st.rerun()
+        if not jobs:
+            return
+        st.subheader("Your Uploads")
+        for job in jobs:
+            label = f"{job['restaurant_name'] or 'Unnamed menu'} ({job['file_name']})"
+            if job['status'] == 'done':
+                items = [f"{name} - ${price:.2f}" for name, price in job['result']['dishes']]
+                items = items or [line for line in job['result']['lines'] if line.strip()]
+                # Only named restaurants are stored
+                if job['restaurant_name']:
+                    st.session_state.restaurants[job['restaurant_name']] = {
+                        'items': items,
+                        'rating': job['rating'],
+                        'location': job['location']
+                    }
+                with st.expander(f"✅ {label}: found {len(items)} items"):
+                    for i, item in enumerate(items[:20], 1):
                         st.write(f"{i}. {item}")
-            
-            # Store in database
-            if restaurant_name:
-                db.add_restaurant(restaurant_name, restaurant_location)
-                st.session_state.restaurants[restaurant_name] = {
-                    'items': menu_items,
-                    'rating': restaurant_rating,
-                    'location': restaurant_location
-                }
+            elif job['status'] == 'failed':
+                st.error(f"❌ {label}: {job['error']}")
+            else:
+                done = job['done_pages']
+                total = job['total_pages'] or 0
+                st.progress(done / total if total else 0.0,
+                            text=f"⏳ {label}: page {done} of {total or '?'}")
+
+    # Only this section reruns on the timer, and only while an upload is
+    # still being read
+    polling = any(job['status'] in ('queued', 'running')
+                  for job in get_job_queue().recent(st.session_state.session_id, 5))
+    st.fragment(show_uploads, run_every=PROGRESS_REFRESH_SECONDS if polling else None)(polling)
 
 # MY ORDERS PAGE
 elif page == "📊 My Orders":
     st.header("📊 Order History")
     
-    if st.session_state.chat_history:
+    # Only one page of searches is loaded per rerun, newest first
+    total = db.count_turns(user_key, kind='search')
+    if total:
         st.subheader("Your Search History:")
-        for i, entry in enumerate(st.session_state.chat_history, 1):
-            with st.expander(f"Search #{i}: {entry['user'][:50]}..."):
+        pages = st.session_state.history_pages
+        entries = db.chat_history(user_key, HISTORY_PAGE_SIZE, before_id=pages[-1], kind='search')
+        first_number = total - (len(pages) - 1) * HISTORY_PAGE_SIZE
+        for offset, entry in enumerate(entries):
+            with st.expander(f"Search #{first_number - offset}: {entry['user'][:50]}..."):
                 st.write(entry['bot'])
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            if len(pages) > 1 and st.button("⬅️ Newer searches", use_container_width=True):
+                pages.pop()
+                st.rerun()
+        with col2:
+            if first_number > len(entries) and st.button("Older searches ➡️", use_container_width=True):
+                pages.append(entries[-1]['id'])
+                st.rerun()
     else:
         st.info("No searches yet. Start by using the Food Chatbot!")
     
@@ -221,6 +287,70 @@ elif page == "📊 My Orders":
                 if st.button(f"View {restaurant.split()[0]}", key=restaurant):
                     st.write(f"{len(data['items'])} items available")
 
+# ADMIN PAGE
+elif page == "🛠️ Admin":
+    st.header("🛠️ Performance")
+    st.caption(f"Your session: {st.session_state.session_id}")
+    
+    # Latency of each stage across all sessions
+    series = metrics.REGISTRY.snapshot()
+    timings = [
+        {
+            'stage': item['name'][:-len('_seconds')],
+            'labels': ', '.join(f"{name}={value}" for name, value in item['labels'].items()),
+            'calls': item['count'],
+            'mean ms': round(item['sum'] / item['count'] * 1000, 1),
+            'p50 ms ≤': item['p50'] * 1000,
+            'p95 ms ≤': item['p95'] * 1000,
+        }
+        for item in series if item['type'] == 'histogram' and item['name'].endswith('_seconds')
+    ]
+    if timings:
+        st.subheader("Latency by stage")
+        st.dataframe(sorted(timings, key=lambda row: row['mean ms'] * row['calls'], reverse=True),
+                     use_container_width=True)
+    else:
+        st.info("No calls recorded yet.")
+    
+    counters = [
+        {
+            'counter': item['name'],
+            'labels': ', '.join(f"{name}={value}" for name, value in item['labels'].items()),
+            'value': item['value'],
+        }
+        for item in series if item['type'] == 'counter'
+    ]
+    if counters:
+        st.subheader("Cache hits, pages and errors")
+        st.dataframe(counters, use_container_width=True)
+    st.write("AI response cache:", shared_cache().stats())
+    
+    # Where one session's time went, slowest stage first
+    sessions = metrics.REGISTRY.sessions()
+    if sessions:
+        st.subheader("Time by session")
+        default = sessions.index(st.session_state.session_id) if st.session_state.session_id in sessions else 0
+        session = st.selectbox("Session", sessions, index=default)
+        events = metrics.REGISTRY.events(session)
+        stages = {}
+        for event in events:
+            stage = event['name'] + ''.join(f" {value}" for value in event['labels'].values())
+            total, calls, errors = stages.get(stage, (0.0, 0, 0))
+            stages[stage] = (total + event['seconds'], calls + 1, errors + (event['error'] is not None))
+        st.dataframe(
+            [{'stage': stage, 'total ms': round(total * 1000, 1), 'calls': calls, 'errors': errors}
+             for stage, (total, calls, errors) in sorted(stages.items(), key=lambda item: -item[1][0])],
+            use_container_width=True
+        )
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("⬇️ Prometheus metrics", metrics.REGISTRY.prometheus_text(),
+                           file_name="metrics.prom", mime="text/plain")
+    with col2:
+        st.download_button("⬇️ JSON lines", metrics.REGISTRY.json_lines(),
+                           file_name="metrics.jsonl", mime="application/json")
+
 # Footer
 st.divider()
 st.markdown("""
@@ -228,4 +358,5 @@ st.markdown("""
     <p>GRAB Senior Helper v1.0 | Designed for Senior Citizens in Singapore</p>
     <p>For support, contact: support@grabseniorhelper.sg</p>
 </div>
-""", unsafe_allow_html=True)
\ No newline at end of file
+""", unsafe_allow_html=True)
+
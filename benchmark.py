@@ -0,0 +1,283 @@
+"""
+Benchmark the extraction, database and prompt-building hot paths
+
+Synthetic menus (text PDFs and scanned, image-only PDFs) are generated
+locally, so no fixtures or network access are needed. Gemini is replaced
+by a stub model, so prompt benchmarks measure only our own code. Results
+are written as JSON; pass a previous run with --compare to flag
+regressions.
+
+Usage:
+    python benchmark.py                           # everything, results in benchmark_results.json
+    python benchmark.py extraction --pages 1 10
+    python benchmark.py --compare baseline.json --threshold 0.2
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+from menu_parser import extract_menu_items, extract_menu_items_with_ocr
+
+SUITES = ['extraction', 'ocr', 'database', 'prompts']
+
+DISH_NAMES = ['Chicken Rice', 'Duck Rice', 'Fried Rice', 'Nasi Lemak', 'Fish Soup', 'Laksa', 'Char Kway Teow',
+              'Wanton Mee', 'Mee Goreng', 'Porridge', 'Roti Prata', 'Thosai', 'Fish Head Curry', 'Tofu Soup',
+              'Beef Noodles', 'Pork Ribs', 'Prawn Noodles', 'Satay', 'Carrot Cake', 'Chilli Crab']
+SECTIONS = ['Rice', 'Noodles', 'Soups', 'Specials', 'Drinks']
+
+# Menu lines per synthetic page
+LINES_PER_PAGE = 30
+
+
+def menu_page(rng):
+    """Return the lines of one synthetic menu page: a heading, then dishes with prices"""
+    lines = [rng.choice(SECTIONS)]
+    for _ in range(LINES_PER_PAGE - 1):
+        price = rng.randint(250, 2000) / 100
+        lines.append(f"{rng.choice(DISH_NAMES)} ....... ${price:.2f}")
+    return lines
+
+
+def write_text_pdf(path, pages):
+    """Write a PDF with one text page (Helvetica, 12pt) per list of lines"""
+    objects = [b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    pages_id = 2 + 2 * len(pages)
+    page_ids = []
+    for lines in pages:
+        text = b' '.join(b'(' + line.encode('latin-1') + b") '" for line in lines)
+        stream = b'BT /F1 12 Tf 14 TL 72 760 Td ' + text + b' ET'
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+        objects.append(b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] /Contents %d 0 R '
+                       b'/Resources << /Font << /F1 1 0 R >> >> >>' % (pages_id, len(objects)))
+        page_ids.append(len(objects))
+    kids = b' '.join(b'%d 0 R' % page_id for page_id in page_ids)
+    objects.append(b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(page_ids)))
+    objects.append(b'<< /Type /Catalog /Pages %d 0 R >>' % pages_id)
+
+    data = b'%PDF-1.4\n'
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+    xref = len(data)
+    data += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    data += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    data += b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (
+        len(objects) + 1, len(objects), xref)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def write_scanned_pdf(path, pages, dpi=100):
+    """Write an image-only PDF, as produced by a scanner, with one page per list of lines"""
+    from PIL import Image, ImageDraw
+
+    scale = dpi / 72
+    images = []
+    for lines in pages:
+        image = Image.new('L', (int(612 * scale), int(792 * scale)), 255)
+        draw = ImageDraw.Draw(image)
+        for i, line in enumerate(lines):
+            draw.text((72 * scale, (32 + 14 * i) * scale), line, fill=0)
+        images.append(image)
+    images[0].save(path, save_all=True, append_images=images[1:], resolution=dpi)
+
+
+def measure(func, repeat):
+    """Call func `repeat` times and return timing statistics in milliseconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return {
+        'runs': repeat,
+        'min_ms': round(min(times), 3),
+        'median_ms': round(statistics.median(times), 3),
+        'max_ms': round(max(times), 3),
+    }
+
+
+def record(results, name, func, repeat, **params):
+    # Failures (e.g. tesseract not installed) are reported, not fatal
+    try:
+        entry = measure(func, repeat)
+    except Exception as e:
+        entry = {'error': f'{type(e).__name__}: {e}'}
+    entry = dict(name=name, params=params, **entry)
+    results.append(entry)
+    status = entry.get('error') or f"{entry['median_ms']:.2f} ms median"
+    print(f"{name:<28} {json.dumps(params):<40} {status}", file=sys.stderr)
+
+
+def bench_extraction(results, args, workdir, rng):
+    for count in args.pages:
+        path = os.path.join(workdir, f'text_{count}.pdf')
+        write_text_pdf(path, [menu_page(rng) for _ in range(count)])
+        for workers in (1, None):
+            record(results, 'extract_menu_items', lambda: extract_menu_items(path, workers=workers),
+                   args.repeat, pages=count, workers=workers or 'default')
+
+
+def bench_ocr(results, args, workdir, rng):
+    for count in args.ocr_pages:
+        path = os.path.join(workdir, f'scanned_{count}.pdf')
+        write_scanned_pdf(path, [menu_page(rng) for _ in range(count)])
+        record(results, 'extract_menu_items_with_ocr', lambda: extract_menu_items_with_ocr(path),
+               args.repeat, pages=count)
+
+
+def bench_database(results, args, workdir, rng):
+    from database import Database
+
+    db = Database(os.path.join(workdir, 'bench.db'))
+    menus = [{'Main Menu': [(f'{rng.choice(DISH_NAMES)} {i}', rng.randint(250, 2000) / 100)
+                            for i in range(args.dishes)]}
+             for _ in range(args.restaurants)]
+    counter = iter(range(10 ** 9))
+    record(results, 'Database.ingest_restaurant',
+           lambda: db.ingest_restaurant(f'Restaurant {next(counter)}', 'Singapore', rng.choice(menus)),
+           args.repeat, dishes=args.dishes)
+    for i in range(args.restaurants):
+        db.ingest_restaurant(f'Stall {i}', 'Singapore', menus[i])
+
+    queries = [
+        ('text', dict(text='chicken rice')),
+        ('text_price', dict(text='noodles', max_price=8)),
+        ('text_exclude', dict(text='rice', exclude=['Pork', 'Beef'])),
+        ('price_only', dict(min_price=5, max_price=10)),
+    ]
+    for label, query in queries:
+        record(results, 'Database.search_dishes', lambda: db.search_dishes(**query), args.repeat,
+               query=label, rows=args.restaurants * args.dishes)
+    db.close()
+
+
+class StubModel:
+    """Stands in for genai.GenerativeModel and answers instantly"""
+
+    def __init__(self, model_name, *args, **kwargs):
+        self.model_name = model_name
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        response = types.SimpleNamespace(text='Chicken Rice - $4.50')
+        return iter([response]) if stream else response
+
+    async def generate_content_async(self, prompt, **kwargs):
+        return types.SimpleNamespace(text='Chicken Rice - $4.50')
+
+
+def install_stub_model():
+    """Make google.generativeai return StubModel, whether or not the SDK is installed"""
+    try:
+        import google.generativeai as genai
+    except ImportError:
+        genai = types.ModuleType('google.generativeai')
+        sys.modules.setdefault('google', types.ModuleType('google')).generativeai = genai
+        sys.modules['google.generativeai'] = genai
+    genai.configure = lambda **kwargs: None
+    genai.GenerativeModel = StubModel
+
+
+def bench_prompts(results, args, workdir, rng):
+    from ai_chatbot import AIChatbot, AsyncGeminiClient, ResponseCache, TokenBucket, build_menu_context
+
+    install_stub_model()
+    dishes = [{'name': rng.choice(DISH_NAMES), 'price': rng.randint(250, 2000) / 100,
+               'restaurant': f'Stall {i % 50}', 'rating': rng.randint(30, 50) / 10}
+              for i in range(args.restaurants * args.dishes)]
+    record(results, 'build_menu_context', lambda: build_menu_context(dishes, 'chicken rice', max_price=10),
+           args.repeat, dishes=len(dishes))
+
+    # A new query every run, so every call misses the response cache
+    chatbot = AIChatbot('stub-key', cache=ResponseCache())
+    # A limiter that never throttles, so the process-wide quota's sleeps
+    # and fallbacks are not measured
+    chatbot.client = AsyncGeminiClient(StubModel('stub'), limiter=TokenBucket(per_minute=10 ** 9, burst=10 ** 9))
+    counter = iter(range(10 ** 9))
+    record(results, 'AIChatbot.search_menu_items',
+           lambda: chatbot.search_menu_items(f'chicken rice {next(counter)}', dishes, max_price=10),
+           args.repeat, dishes=len(dishes))
+    record(results, 'AIChatbot.parse_request', lambda: chatbot.parse_request('我想吃鸡饭，不要猪肉，10块以下'),
+           args.repeat)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    """Print benchmarks whose median got slower than the baseline by more than threshold; return them"""
+    with open(baseline_path) as f:
+        baseline = {(entry['name'], json.dumps(entry['params'], sort_keys=True)): entry
+                    for entry in json.load(f)['results']}
+    regressions = []
+    for entry in results:
+        before = baseline.get((entry['name'], json.dumps(entry['params'], sort_keys=True)))
+        if before is None or 'median_ms' not in before or 'median_ms' not in entry:
+            continue
+        change = entry['median_ms'] / before['median_ms'] - 1 if before['median_ms'] else 0
+        marker = 'REGRESSION' if change > threshold else ''
+        print(f"{entry['name']:<28} {json.dumps(entry['params']):<40} "
+              f"{before['median_ms']:>9.2f} -> {entry['median_ms']:>9.2f} ms {change:>+7.1%} {marker}")
+        if change > threshold:
+            regressions.append(entry)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('suites', nargs='*', help=f"suites to run: {', '.join(SUITES)} (default: all)")
+    parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 100], help='text PDF sizes')
+    parser.add_argument('--ocr-pages', type=int, nargs='+', default=[1, 10], help='scanned PDF sizes')
+    parser.add_argument('--restaurants', type=int, default=100, help='restaurants in the database suite')
+    parser.add_argument('--dishes', type=int, default=50, help='dishes per restaurant')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per benchmark')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the synthetic menus')
+    parser.add_argument('--output', default='benchmark_results.json', help='where to write the JSON results')
+    parser.add_argument('--compare', metavar='BASELINE', help='previous results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown counted as a regression')
+    args = parser.parse_args()
+    for suite in args.suites:
+        if suite not in SUITES:
+            parser.error(f'unknown suite {suite!r}')
+
+    benches = {'extraction': bench_extraction, 'ocr': bench_ocr, 'database': bench_database,
+               'prompts': bench_prompts}
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for suite in args.suites or SUITES:
+            benches[suite](results, args, workdir, random.Random(args.seed))
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}", file=sys.stderr)
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
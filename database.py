@@ -1,40 +1,724 @@
+import json
+import queue
+import re
 import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+import metrics
+from query_parser import LEXICON_VERSION, NOT_INGREDIENTS, RESTRICTIONS, exclusion_mask, restriction_mask
+
+# Pragmas applied to every pooled connection. WAL lets readers run
+# alongside a writer; NORMAL sync is durable in WAL mode and avoids an
+# fsync per commit.
+PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -16000),  # 16 MB page cache per connection
+    ('mmap_size', 64 * 1024 * 1024),
+    ('temp_store', 'MEMORY'),
+)
+
+# Seconds a connection waits on a locked database before raising
+BUSY_TIMEOUT = 10
+
+POOL_SIZE = 5
+
+# Default number of candidates returned by search_dishes
+SEARCH_LIMIT = 10
+
+# Cosine similarity below which a semantic match is not worth showing, and
+# the share of the best match's similarity the others must reach
+MIN_SIMILARITY = 0.2
+RELATIVE_SIMILARITY = 0.6
+
+# Semantic matches only stand in when the keyword search finds fewer dishes
+# than this, and at most SEMANTIC_LIMIT of them are added
+SEMANTIC_FILL_BELOW = 3
+SEMANTIC_LIMIT = 10
+
+# Turns kept per user before the oldest are folded into a summary, the
+# summary's maximum length, and the default page size of chat_history
+HISTORY_MAX_TURNS = 200
+SUMMARY_MAX_CHARS = 2000
+HISTORY_PAGE_SIZE = 10
+
+# Upper bounds (SGD) of the price bands counted per restaurant: under $5,
+# $5-10, $10-20 and $20 and up
+PRICE_BANDS = (5, 10, 20)
+
+# Default number of restaurants returned by top_rated
+TOP_RATED_LIMIT = 5
+
+# Compiled statements kept per connection; the SQL below is written as
+# fixed strings so repeated calls reuse the prepared statement
+STATEMENT_CACHE_SIZE = 256
+
+
+_DISH_SELECT = '''SELECT d.id, d.name, d.price, d.description, r.name, r.location, d.restriction_mask, r.rating
+                  FROM dishes d
+                  JOIN menus m ON m.id = d.menu_id
+                  JOIN restaurants r ON r.id = m.restaurant_id'''
+_DISH_KEYS = ('id', 'name', 'price', 'description', 'restaurant', 'location', 'restriction_mask', 'rating')
+
+# Changes whenever an ingredient is added to query_parser.RESTRICTIONS or
+# the way they are matched changes, so stored restriction masks are recomputed
+_RESTRICTION_LEXICON = str(zlib.crc32(json.dumps([LEXICON_VERSION, RESTRICTIONS, NOT_INGREDIENTS],
+                                                 sort_keys=True).encode('utf-8')))
+
+# Changes whenever the aggregate tables or their triggers change, so they
+# are recreated and recounted
+_STATS_VERSION = '1:' + ','.join(str(bound) for bound in PRICE_BANDS)
+_PRICE_BAND_COLUMNS = [f'price_band_{i}' for i in range(len(PRICE_BANDS) + 1)]
+_STATS_SELECT = ', '.join(['s.dish_count', 's.price_sum'] + ['s.' + column for column in _PRICE_BAND_COLUMNS])
+
+
+def _price_band_labels():
+    bounds = list(PRICE_BANDS)
+    labels = [f'under ${bounds[0]}']
+    labels += [f'${low}-{high}' for low, high in zip(bounds, bounds[1:])]
+    return labels + [f'${bounds[-1]} and up']
+
+
+def _price_band_tests(price):
+    # One 0/1 SQL expression per band: whether `price` falls into it
+    bounds = [None] + list(PRICE_BANDS) + [None]
+    tests = []
+    for low, high in zip(bounds, bounds[1:]):
+        parts = ([f'{price} >= {low}'] if low is not None else []) + ([f'{price} < {high}'] if high is not None else [])
+        tests.append('(' + ' AND '.join(parts) + ')')
+    return tests
+
+
+def _stats_change(sign, row):
+    # SET clause adding (sign '+') or removing (sign '-') a dish row
+    # (new/old in a trigger) from its restaurant's aggregates
+    columns = [f'dish_count = dish_count {sign} 1', f'price_sum = price_sum {sign} {row}.price']
+    columns += [f'{column} = {column} {sign} {test}'
+                for column, test in zip(_PRICE_BAND_COLUMNS, _price_band_tests(f'{row}.price'))]
+    return (f'UPDATE restaurant_stats SET {", ".join(columns)} '
+            f'WHERE restaurant_id = (SELECT restaurant_id FROM menus WHERE id = {row}.menu_id);')
+
+
+_STATS_TRIGGERS = {
+    'stats_restaurant_insert': '''AFTER INSERT ON restaurants BEGIN
+                                    UPDATE catalog_stats SET restaurants = restaurants + 1;
+                                    INSERT OR IGNORE INTO restaurant_stats (restaurant_id) VALUES (new.id);
+                                  END''',
+    'stats_restaurant_delete': '''AFTER DELETE ON restaurants BEGIN
+                                    UPDATE catalog_stats SET restaurants = restaurants - 1;
+                                    DELETE FROM restaurant_stats WHERE restaurant_id = old.id;
+                                  END''',
+    'stats_dish_insert': f'''AFTER INSERT ON dishes BEGIN
+                               UPDATE catalog_stats SET dishes = dishes + 1;
+                               {_stats_change('+', 'new')}
+                             END''',
+    'stats_dish_delete': f'''AFTER DELETE ON dishes BEGIN
+                               UPDATE catalog_stats SET dishes = dishes - 1;
+                               {_stats_change('-', 'old')}
+                             END''',
+    'stats_dish_update': f'''AFTER UPDATE OF price, menu_id ON dishes BEGIN
+                               {_stats_change('-', 'old')}
+                               {_stats_change('+', 'new')}
+                             END''',
+    # A user's first turn; truncation always keeps their newest turns
+    'stats_user_insert': '''AFTER INSERT ON chat_history
+                            WHEN NOT EXISTS (SELECT 1 FROM chat_history
+                                             WHERE user_key = new.user_key AND id != new.id) BEGIN
+                              UPDATE catalog_stats SET users = users + 1;
+                            END''',
+}
+
+
+class ConnectionPool:
+    """A fixed-size pool of SQLite connections that can be shared between threads"""
+
+    def __init__(self, db_name, size=POOL_SIZE):
+        self.db_name = db_name
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # IMMEDIATE takes the write lock when a transaction starts, so two
+        # writers wait on the busy timeout instead of failing mid-transaction
+        connection = sqlite3.connect(self.db_name, timeout=BUSY_TIMEOUT, check_same_thread=False,
+                                     isolation_level='IMMEDIATE', cached_statements=STATEMENT_CACHE_SIZE)
+        for name, value in PRAGMAS:
+            connection.execute(f'PRAGMA {name} = {value}')
+        return connection
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return self._connect()
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self):
+        connection = self._acquire()
+        try:
+            yield connection
+        finally:
+            self._idle.put(connection)
+
+    def close(self):
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._created = 0
+
 
 class Database:
-    def __init__(self, db_name='restaurants.db'):
-        self.connection = sqlite3.connect(db_name)
-        self.cursor = self.connection.cursor()
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, db_name='restaurants.db', pool_size=POOL_SIZE, vector_index=None):
+        if db_name == ':memory:':
+            # Every connection to :memory: is a separate database
+            pool_size = 1
+        self.pool = ConnectionPool(db_name, pool_size)
         self.create_tables()
+        # Optional vector_index.VectorIndex kept in step with the dishes
+        # table, used by search_dishes for requests keywords miss
+        self.vector_index = vector_index
+        if vector_index is not None:
+            self._sync_vector_index()
+
+    @classmethod
+    def shared(cls, db_name='restaurants.db', vector_index=None):
+        """Return the process-wide Database for db_name, creating it on first use"""
+        with cls._shared_lock:
+            if db_name not in cls._shared:
+                cls._shared[db_name] = cls(db_name, vector_index=vector_index)
+            return cls._shared[db_name]
+
+    @contextmanager
+    def transaction(self):
+        """Yield a cursor on a pooled connection, committing on success and rolling back on error"""
+        with self.pool.connection() as connection:
+            with connection:
+                yield connection.cursor()
 
     def create_tables(self):
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS restaurants (
+        with self.transaction() as cursor:
+            self._create_tables(cursor)
+
+    def _create_tables(self, cursor):
+        cursor.execute('''CREATE TABLE IF NOT EXISTS restaurants (
                                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                                 name TEXT NOT NULL,
                                 location TEXT NOT NULL);''')
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS menus (
+        cursor.execute('''CREATE TABLE IF NOT EXISTS menus (
                                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                                 restaurant_id INTEGER,
                                 name TEXT NOT NULL,
                                 FOREIGN KEY (restaurant_id) REFERENCES restaurants(id));''')
-        self.cursor.execute('''CREATE TABLE IF NOT EXISTS dishes (
+        cursor.execute('''CREATE TABLE IF NOT EXISTS dishes (
                                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                                 menu_id INTEGER,
                                 name TEXT NOT NULL,
                                 price REAL NOT NULL,
                                 FOREIGN KEY (menu_id) REFERENCES menus(id));''')
-        self.connection.commit()
+
+        # Natural keys used for upserts; older databases may already hold
+        # duplicates from repeated uploads, so merge them first
+        self._merge_duplicates(cursor, 'restaurants', ('name', 'location'), 'menus', 'restaurant_id')
+        self._merge_duplicates(cursor, 'menus', ('restaurant_id', 'name'), 'dishes', 'menu_id')
+        self._merge_duplicates(cursor, 'dishes', ('menu_id', 'name'))
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_restaurants_key ON restaurants (name, location)')
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_menus_key ON menus (restaurant_id, name)')
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_dishes_key ON dishes (menu_id, name)')
+        self._add_column(cursor, 'dishes', 'description', 'TEXT')
+        # Bitwise OR of query_parser.RESTRICTION_BITS for the ingredients a
+        # dish's name and description mention
+        self._add_column(cursor, 'dishes', 'restriction_mask', 'INTEGER')
+        # PDF page a dish was read from, and each page's content digest and
+        # extracted lines, so a re-uploaded menu only re-extracts the pages
+        # that changed
+        self._add_column(cursor, 'dishes', 'page', 'INTEGER')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS menu_pages (
+                                restaurant_id INTEGER NOT NULL,
+                                page INTEGER NOT NULL,
+                                digest TEXT NOT NULL,
+                                lines TEXT NOT NULL,
+                                PRIMARY KEY (restaurant_id, page),
+                                FOREIGN KEY (restaurant_id) REFERENCES restaurants(id));''')
+        # menu_parser.extractor_key of the settings that produced the lines;
+        # pages stored before it existed are never reused
+        self._add_column(cursor, 'menu_pages', 'extractor', 'TEXT')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS settings (
+                                key TEXT PRIMARY KEY,
+                                value TEXT NOT NULL);''')
+        self._compute_restriction_masks(cursor)
+
+        # Lookup indexes for price filters and restaurant joins
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_dishes_price ON dishes (price)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_menus_restaurant ON menus (restaurant_id)')
+        self._create_search_index(cursor)
+
+        # One row per question and answer, so a turn is a single write
+        cursor.execute('''CREATE TABLE IF NOT EXISTS chat_history (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                user_key TEXT NOT NULL,
+                                kind TEXT NOT NULL,
+                                user_text TEXT NOT NULL,
+                                bot_text TEXT NOT NULL,
+                                created_at REAL NOT NULL);''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_history_user ON chat_history (user_key, id)')
+        cursor.execute('''CREATE TABLE IF NOT EXISTS chat_summaries (
+                                user_key TEXT PRIMARY KEY,
+                                summary TEXT NOT NULL);''')
+
+        self._add_column(cursor, 'restaurants', 'rating', 'REAL')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_restaurants_rating ON restaurants (rating)')
+        self._create_stats(cursor)
+
+    def _add_column(self, cursor, table, column, declaration):
+        # Add a column to a table created by an older version of the app
+        columns = [row[1] for row in cursor.execute(f'PRAGMA table_info({table})')]
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {declaration}')
+
+    def _compute_restriction_masks(self, cursor):
+        # Fill in masks of dishes stored before the column existed, or of
+        # every dish when the ingredient lexicon has changed
+        row = cursor.execute("SELECT value FROM settings WHERE key = 'restriction_lexicon'").fetchone()
+        sql = 'SELECT id, name, description FROM dishes'
+        if row and row[0] == _RESTRICTION_LEXICON:
+            sql += ' WHERE restriction_mask IS NULL'
+        rows = cursor.execute(sql).fetchall()
+        cursor.executemany('UPDATE dishes SET restriction_mask = ? WHERE id = ?',
+                           [(restriction_mask(self._dish_text(name, description)), dish_id)
+                            for dish_id, name, description in rows])
+        cursor.execute("INSERT INTO settings (key, value) VALUES ('restriction_lexicon', ?) "
+                       'ON CONFLICT (key) DO UPDATE SET value = excluded.value', (_RESTRICTION_LEXICON,))
+
+    def _create_search_index(self, cursor):
+        # Full-text index over dish names and descriptions, kept in sync
+        # with the dishes table by triggers
+        exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'dishes_fts'").fetchone()
+        cursor.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS dishes_fts USING fts5 (
+                                name, description,
+                                content='dishes', content_rowid='id',
+                                tokenize='unicode61 remove_diacritics 2');''')
+        cursor.execute('''CREATE TRIGGER IF NOT EXISTS dishes_fts_insert AFTER INSERT ON dishes BEGIN
+                                INSERT INTO dishes_fts (rowid, name, description)
+                                VALUES (new.id, new.name, new.description);
+                              END;''')
+        cursor.execute('''CREATE TRIGGER IF NOT EXISTS dishes_fts_delete AFTER DELETE ON dishes BEGIN
+                                INSERT INTO dishes_fts (dishes_fts, rowid, name, description)
+                                VALUES ('delete', old.id, old.name, old.description);
+                              END;''')
+        cursor.execute('''CREATE TRIGGER IF NOT EXISTS dishes_fts_update AFTER UPDATE ON dishes BEGIN
+                                INSERT INTO dishes_fts (dishes_fts, rowid, name, description)
+                                VALUES ('delete', old.id, old.name, old.description);
+                                INSERT INTO dishes_fts (rowid, name, description)
+                                VALUES (new.id, new.name, new.description);
+                              END;''')
+        if not exists:
+            # Index dishes stored before the search index existed
+            cursor.execute("INSERT INTO dishes_fts (dishes_fts) VALUES ('rebuild')")
+
+    def _create_stats(self, cursor):
+        # Aggregates kept up to date by triggers, so the home page reads
+        # counts without scanning the tables: one row of catalog-wide
+        # totals and one row per restaurant
+        row = cursor.execute("SELECT value FROM settings WHERE key = 'stats_version'").fetchone()
+        if row and row[0] == _STATS_VERSION:
+            return
+        for name in _STATS_TRIGGERS:
+            cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+        cursor.execute('DROP TABLE IF EXISTS catalog_stats')
+        cursor.execute('DROP TABLE IF EXISTS restaurant_stats')
+        cursor.execute('''CREATE TABLE catalog_stats (
+                                id INTEGER PRIMARY KEY CHECK (id = 1),
+                                restaurants INTEGER NOT NULL,
+                                dishes INTEGER NOT NULL,
+                                users INTEGER NOT NULL);''')
+        bands = ''.join(f'\n                                {column} INTEGER NOT NULL DEFAULT 0,'
+                        for column in _PRICE_BAND_COLUMNS)
+        cursor.execute(f'''CREATE TABLE restaurant_stats (
+                                restaurant_id INTEGER PRIMARY KEY,
+                                dish_count INTEGER NOT NULL DEFAULT 0,
+                                price_sum REAL NOT NULL DEFAULT 0,{bands}
+                                FOREIGN KEY (restaurant_id) REFERENCES restaurants(id));''')
+        for name, body in _STATS_TRIGGERS.items():
+            cursor.execute(f'CREATE TRIGGER {name} {body};')
+
+        # Count what is already stored
+        cursor.execute('''INSERT INTO catalog_stats (id, restaurants, dishes, users)
+                          VALUES (1, (SELECT COUNT(*) FROM restaurants), (SELECT COUNT(*) FROM dishes),
+                                  (SELECT COUNT(DISTINCT user_key) FROM chat_history))''')
+        band_sums = ', '.join(f'COALESCE(SUM({test}), 0)' for test in _price_band_tests('d.price'))
+        cursor.execute(f'''INSERT INTO restaurant_stats (restaurant_id, dish_count, price_sum,
+                                                         {', '.join(_PRICE_BAND_COLUMNS)})
+                           SELECT r.id, COUNT(d.id), COALESCE(SUM(d.price), 0), {band_sums}
+                           FROM restaurants r
+                           LEFT JOIN menus m ON m.restaurant_id = r.id
+                           LEFT JOIN dishes d ON d.menu_id = m.id
+                           GROUP BY r.id''')
+        cursor.execute("INSERT INTO settings (key, value) VALUES ('stats_version', ?) "
+                       'ON CONFLICT (key) DO UPDATE SET value = excluded.value', (_STATS_VERSION,))
+
+    def _merge_duplicates(self, cursor, table, key_columns, child_table=None, child_column=None):
+        # Keep the oldest row per natural key and re-point children at it
+        key = ', '.join(key_columns)
+        duplicates = f'''SELECT t.id, k.keep_id FROM {table} t
+                         JOIN (SELECT {key}, MIN(id) AS keep_id FROM {table} GROUP BY {key}) k
+                         USING ({key}) WHERE t.id != k.keep_id'''
+        rows = cursor.execute(duplicates).fetchall()
+        if not rows:
+            return
+        if child_table:
+            cursor.executemany(f'UPDATE OR IGNORE {child_table} SET {child_column} = ? WHERE {child_column} = ?',
+                               [(keep_id, old_id) for old_id, keep_id in rows])
+        cursor.executemany(f'DELETE FROM {table} WHERE id = ?', [(old_id,) for old_id, _ in rows])
+
+    @staticmethod
+    def _dish_text(name, description):
+        return f"{name} {description or ''}".strip()
+
+    def _sync_vector_index(self):
+        # Embed dishes stored before the index existed (or by a process
+        # without one) and drop vectors of deleted dishes
+        with self.pool.connection() as connection:
+            rows = connection.execute('SELECT id, name, description FROM dishes').fetchall()
+        indexed = set(self.vector_index.ids().tolist())
+        current = {row[0] for row in rows}
+        self.vector_index.remove(list(indexed - current))
+        missing = [row for row in rows if row[0] not in indexed]
+        self.vector_index.upsert([row[0] for row in missing], [self._dish_text(row[1], row[2]) for row in missing])
+
+    # The add_* methods return the existing row's id when it is already
+    # stored, so adding a restaurant again does not duplicate it
 
     def add_restaurant(self, name, location):
-        self.cursor.execute('INSERT INTO restaurants (name, location) VALUES (?, ?)', (name, location))
-        self.connection.commit()
+        with self.transaction() as cursor:
+            cursor.execute('INSERT INTO restaurants (name, location) VALUES (?, ?) '
+                           'ON CONFLICT (name, location) DO NOTHING', (name, location))
+            return cursor.execute('SELECT id FROM restaurants WHERE name = ? AND location = ?',
+                                  (name, location)).fetchone()[0]
 
     def add_menu(self, restaurant_id, menu_name):
-        self.cursor.execute('INSERT INTO menus (restaurant_id, name) VALUES (?, ?)', (restaurant_id, menu_name))
-        self.connection.commit()
+        with self.transaction() as cursor:
+            cursor.execute('INSERT INTO menus (restaurant_id, name) VALUES (?, ?) '
+                           'ON CONFLICT (restaurant_id, name) DO NOTHING', (restaurant_id, menu_name))
+            return cursor.execute('SELECT id FROM menus WHERE restaurant_id = ? AND name = ?',
+                                  (restaurant_id, menu_name)).fetchone()[0]
 
     def add_dish(self, menu_id, dish_name, price):
-        self.cursor.execute('INSERT INTO dishes (menu_id, name, price) VALUES (?, ?, ?)', (menu_id, dish_name, price))
-        self.connection.commit()
+        with self.transaction() as cursor:
+            cursor.execute('INSERT INTO dishes (menu_id, name, price, restriction_mask) VALUES (?, ?, ?, ?) '
+                           'ON CONFLICT (menu_id, name) DO UPDATE SET price = excluded.price '
+                           'WHERE price != excluded.price',
+                           (menu_id, dish_name, price, restriction_mask(dish_name)))
+            return cursor.execute('SELECT id FROM dishes WHERE menu_id = ? AND name = ?',
+                                  (menu_id, dish_name)).fetchone()[0]
+
+    def menu_pages(self, name, location, extractor):
+        """
+        Return {digest: lines} of the pages stored with a restaurant's menu
+        Only pages extracted with the same menu_parser.extractor_key are
+        returned; menu_parser.known_pages picks the ones to pass as `known`
+        to menu_parser.extract_menu_pages_cached.
+        """
+        with self.pool.connection() as connection:
+            rows = connection.execute('SELECT p.digest, p.lines FROM menu_pages p '
+                                      'JOIN restaurants r ON r.id = p.restaurant_id '
+                                      'WHERE r.name = ? AND r.location = ? AND p.extractor = ?',
+                                      (name, location, extractor)).fetchall()
+        return {digest: json.loads(lines) for digest, lines in rows}
+
+    def ingest_restaurant(self, name, location, menus, pages=None, rating=None):
+        """
+        Write a restaurant with all its menus and dishes in one transaction
+        `menus` maps menu name -> [(dish_name, price[, description[, page]]), ...].
+        Existing rows are updated in place, so re-uploading a menu does not
+        duplicate anything, and dishes no longer on a menu are removed.
+        `pages` ({page_number: (digest, lines, extractor)}) replaces the
+        stored pages of the restaurant's PDF; only pages whose digest or
+        extractor changed are rewritten. A `rating` (1-5 stars) replaces the stored one. Each
+        dish's restriction mask is computed here, and only new or changed
+        dishes are embedded into the vector index.
+        Returns {'restaurant_id': id, 'menus': {menu_name: menu_id},
+        'dishes': {menu_name: [dish_id, ...]}} with dish ids in input order.
+        """
+        return self.ingest_restaurants([(name, location, menus, pages, rating)])[0]
+
+    def ingest_restaurants(self, restaurants):
+        """
+        Write many restaurants in one transaction, for bulk imports
+        `restaurants` is a list of (name, location, menus[, pages[, rating]])
+        as taken by ingest_restaurant; their results are returned in the same
+        order. The vector index is updated once for the whole batch.
+        """
+        results = []
+        changed = {}  # dish id -> text to embed
+        removed = []
+        with metrics.timer('db_query', op='ingest_restaurant'), self.transaction() as cursor:
+            for restaurant in restaurants:
+                name, location, menus = restaurant[:3]
+                pages = restaurant[3] if len(restaurant) > 3 else None
+                rating = restaurant[4] if len(restaurant) > 4 else None
+                results.append(self._ingest(cursor, name, location, menus, pages, rating, changed, removed))
+        if self.vector_index is not None:
+            self.vector_index.remove(removed)
+            self.vector_index.upsert(list(changed), list(changed.values()))
+        return results
+
+    def _ingest(self, cursor, name, location, menus, pages, rating, changed, removed):
+        # Body of ingest_restaurants for one restaurant; ids of dishes to
+        # embed and to drop from the vector index are added to changed and
+        # removed
+        cursor.execute('INSERT INTO restaurants (name, location, rating) VALUES (?, ?, ?) '
+                       'ON CONFLICT (name, location) DO UPDATE SET rating = excluded.rating '
+                       'WHERE excluded.rating IS NOT NULL AND rating IS NOT excluded.rating',
+                       (name, location, rating))
+        restaurant_id = cursor.execute('SELECT id FROM restaurants WHERE name = ? AND location = ?',
+                                       (name, location)).fetchone()[0]
+        result = {'restaurant_id': restaurant_id, 'menus': {}, 'dishes': {}}
+
+        for menu_name, dishes in menus.items():
+            cursor.execute('INSERT INTO menus (restaurant_id, name) VALUES (?, ?) '
+                           'ON CONFLICT (restaurant_id, name) DO NOTHING', (restaurant_id, menu_name))
+            menu_id = cursor.execute('SELECT id FROM menus WHERE restaurant_id = ? AND name = ?',
+                                     (restaurant_id, menu_name)).fetchone()[0]
+            result['menus'][menu_name] = menu_id
+
+            # Unchanged rows are left alone so the search index is not rewritten
+            rows = []
+            for dish in dishes:
+                description = dish[2] if len(dish) > 2 else None
+                rows.append((menu_id, dish[0], dish[1], description,
+                             restriction_mask(self._dish_text(dish[0], description)),
+                             dish[3] if len(dish) > 3 else None))
+            before = dict(cursor.execute('SELECT name, description FROM dishes WHERE menu_id = ?', (menu_id,)))
+            cursor.executemany('INSERT INTO dishes (menu_id, name, price, description, restriction_mask, page) '
+                               'VALUES (?, ?, ?, ?, ?, ?) '
+                               'ON CONFLICT (menu_id, name) DO UPDATE SET '
+                               'price = excluded.price, description = excluded.description, '
+                               'restriction_mask = excluded.restriction_mask, page = excluded.page '
+                               'WHERE price != excluded.price OR description IS NOT excluded.description '
+                               'OR restriction_mask IS NOT excluded.restriction_mask '
+                               'OR page IS NOT excluded.page',
+                               rows)
+            ids = dict(cursor.execute('SELECT name, id FROM dishes WHERE menu_id = ?', (menu_id,)))
+            names = {row[1] for row in rows}
+            stale = [dish_id for dish_name, dish_id in ids.items() if dish_name not in names]
+            cursor.executemany('DELETE FROM dishes WHERE id = ?', [(dish_id,) for dish_id in stale])
+            removed.extend(stale)
+            for _, dish_name, _, description, _, _ in rows:
+                if dish_name not in before or before[dish_name] != description:
+                    changed[ids[dish_name]] = self._dish_text(dish_name, description)
+            result['dishes'][menu_name] = [ids[row[1]] for row in rows]
+            metrics.observe('db_rows', len(rows), metrics.SIZE_BUCKETS, op='ingest_restaurant')
+        if pages is not None:
+            self._store_pages(cursor, restaurant_id, pages)
+        return result
+
+    def _store_pages(self, cursor, restaurant_id, pages):
+        cursor.execute('DELETE FROM menu_pages WHERE restaurant_id = ? AND page > ?',
+                       (restaurant_id, max(pages, default=0)))
+        cursor.executemany('INSERT INTO menu_pages (restaurant_id, page, digest, lines, extractor) '
+                           'VALUES (?, ?, ?, ?, ?) ON CONFLICT (restaurant_id, page) DO UPDATE SET '
+                           'digest = excluded.digest, lines = excluded.lines, extractor = excluded.extractor '
+                           'WHERE digest != excluded.digest OR extractor IS NOT excluded.extractor',
+                           [(restaurant_id, number, digest, json.dumps(lines), extractor)
+                            for number, (digest, lines, extractor) in pages.items()])
+
+    def catalog_stats(self):
+        """Return the number of restaurants, dishes and users as a dict, without counting rows"""
+        with self.pool.connection() as connection:
+            row = connection.execute('SELECT restaurants, dishes, users FROM catalog_stats').fetchone()
+        return dict(zip(('restaurants', 'dishes', 'users'), row))
+
+    def _stats_dict(self, row):
+        # (dish_count, price_sum, *bands) -> dict
+        dish_count, price_sum = row[:2]
+        return {
+            'dishes': dish_count,
+            'average_price': price_sum / dish_count if dish_count else None,
+            'price_bands': dict(zip(_price_band_labels(), row[2:])),
+        }
+
+    def restaurant_stats(self, restaurant_id):
+        """
+        Return a restaurant's dish count, average price and price distribution
+        {'dishes': n, 'average_price': SGD or None, 'price_bands':
+        {'under $5': n, '$5-10': n, ...}}, or None for an unknown id.
+        """
+        with self.pool.connection() as connection:
+            row = connection.execute(f'SELECT {_STATS_SELECT} FROM restaurant_stats s WHERE restaurant_id = ?',
+                                     (restaurant_id,)).fetchone()
+        return self._stats_dict(row) if row else None
+
+    def top_rated(self, limit=TOP_RATED_LIMIT):
+        """
+        Return the best rated restaurants with dishes, highest rating first
+        Each is a dict (id, name, location, rating) plus the fields of
+        restaurant_stats. Reads `limit` rows off the rating index.
+        """
+        with self.pool.connection() as connection:
+            rows = connection.execute(f'''SELECT r.id, r.name, r.location, r.rating, {_STATS_SELECT}
+                                          FROM restaurants r
+                                          JOIN restaurant_stats s ON s.restaurant_id = r.id
+                                          WHERE r.rating IS NOT NULL AND s.dish_count > 0
+                                          ORDER BY r.rating DESC LIMIT ?''', (limit,)).fetchall()
+        return [dict(zip(('id', 'name', 'location', 'rating'), row[:4]), **self._stats_dict(row[4:]))
+                for row in rows]
+
+    def add_turn(self, user_key, user_text, bot_text, kind='chat'):
+        """
+        Append a question and its answer to a user's history and return the turn id
+        `kind` separates e.g. 'chat' and 'search' turns. Past
+        HISTORY_MAX_TURNS, the oldest turns are folded into the user's
+        summary and deleted.
+        """
+        with self.transaction() as cursor:
+            cursor.execute('INSERT INTO chat_history (user_key, kind, user_text, bot_text, created_at) '
+                           'VALUES (?, ?, ?, ?, ?)', (user_key, kind, user_text, bot_text, time.time()))
+            turn_id = cursor.lastrowid
+            self._truncate_history(cursor, user_key)
+        return turn_id
+
+    def _truncate_history(self, cursor, user_key):
+        # Only the user's requests of dropped turns are kept, shortened,
+        # newest at the end of the summary
+        old = cursor.execute('SELECT id, user_text FROM chat_history WHERE user_key = ? '
+                             'ORDER BY id DESC LIMIT -1 OFFSET ?', (user_key, HISTORY_MAX_TURNS)).fetchall()
+        if not old:
+            return
+        row = cursor.execute('SELECT summary FROM chat_summaries WHERE user_key = ?', (user_key,)).fetchone()
+        requests = [' '.join(text.split())[:80] for _, text in reversed(old)]
+        summary = '; '.join(part for part in [row[0] if row else ''] + requests if part)
+        cursor.execute('INSERT INTO chat_summaries (user_key, summary) VALUES (?, ?) '
+                       'ON CONFLICT (user_key) DO UPDATE SET summary = excluded.summary',
+                       (user_key, summary[-SUMMARY_MAX_CHARS:]))
+        cursor.execute('DELETE FROM chat_history WHERE user_key = ? AND id <= ?', (user_key, old[0][0]))
+
+    def chat_history(self, user_key, limit=HISTORY_PAGE_SIZE, before_id=None, kind=None):
+        """
+        Return a page of a user's turns, newest first
+        Each turn is a dict (id, kind, user, bot, created_at). Pass the
+        id of the last turn of a page as before_id to get the next, older
+        page.
+        """
+        sql = 'SELECT id, kind, user_text, bot_text, created_at FROM chat_history WHERE user_key = ?'
+        params = [user_key]
+        if before_id is not None:
+            sql += ' AND id < ?'
+            params.append(before_id)
+        if kind is not None:
+            sql += ' AND kind = ?'
+            params.append(kind)
+        sql += ' ORDER BY id DESC LIMIT ?'
+        params.append(limit)
+        with self.pool.connection() as connection:
+            rows = connection.execute(sql, params).fetchall()
+        keys = ('id', 'kind', 'user', 'bot', 'created_at')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def count_turns(self, user_key, kind=None):
+        """Return how many turns are stored for a user"""
+        sql = 'SELECT COUNT(*) FROM chat_history WHERE user_key = ?'
+        params = [user_key]
+        if kind is not None:
+            sql += ' AND kind = ?'
+            params.append(kind)
+        with self.pool.connection() as connection:
+            return connection.execute(sql, params).fetchone()[0]
+
+    def history_summary(self, user_key):
+        """Return the summary of a user's truncated turns, or ''"""
+        with self.pool.connection() as connection:
+            row = connection.execute('SELECT summary FROM chat_summaries WHERE user_key = ?',
+                                     (user_key,)).fetchone()
+        return row[0] if row else ''
+
+    @staticmethod
+    def _match_expression(text):
+        # Turn free text into an FTS5 query: any word, prefix-matched, with
+        # each term quoted so user input cannot inject query syntax
+        terms = re.findall(r'\w+', text.lower())
+        return ' OR '.join('"' + term + '"*' for term in terms)
+
+    def search_dishes(self, text=None, min_price=None, max_price=None, exclude=(), limit=SEARCH_LIMIT,
+                      semantic=True):
+        """
+        Search dishes by free text, price range and excluded ingredients
+        Returns up to `limit` dicts (id, name, price, description,
+        restaurant, location, restriction_mask), best text match first, or
+        cheapest first when no text is given. Restriction and diet names
+        in `exclude` (Pork, Vegetarian, ...) are checked against each
+        dish's restriction mask; other words drop dishes whose name or
+        description mentions them. With a vector index and `semantic`,
+        a keyword search that finds (almost) nothing is topped up with the
+        dishes closest to the text in meaning.
+        """
+        match = self._match_expression(text or '')
+        mask, words = exclusion_mask(exclude)
+        excluded = self._match_expression(' '.join(words))
+
+        filters = []
+        filter_params = []
+        if min_price is not None:
+            filters.append('d.price >= ?')
+            filter_params.append(min_price)
+        if max_price is not None:
+            filters.append('d.price <= ?')
+            filter_params.append(max_price)
+        if mask:
+            filters.append('(d.restriction_mask & ?) = 0')
+            filter_params.append(mask)
+        if excluded:
+            filters.append('d.id NOT IN (SELECT rowid FROM dishes_fts WHERE dishes_fts MATCH ?)')
+            filter_params.append(excluded)
+
+        sql = _DISH_SELECT
+        conditions = list(filters)
+        params = list(filter_params)
+        if match:
+            sql += ' JOIN dishes_fts ON dishes_fts.rowid = d.id'
+            conditions.insert(0, 'dishes_fts MATCH ?')
+            params.insert(0, match)
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY ' + ('bm25(dishes_fts), d.price' if match else 'd.price') + ' LIMIT ?'
+        params.append(limit)
+
+        with metrics.timer('db_query', op='search_dishes'), self.pool.connection() as connection:
+            rows = connection.execute(sql, params).fetchall()
+        if semantic and text and self.vector_index is not None and len(rows) < min(limit, SEMANTIC_FILL_BELOW):
+            rows += self._similar_dishes(text, filters, filter_params, min(limit - len(rows), SEMANTIC_LIMIT),
+                                         {row[0] for row in rows})
+        metrics.observe('db_rows', len(rows), metrics.SIZE_BUCKETS, op='search_dishes')
+        return [dict(zip(_DISH_KEYS, row)) for row in rows]
+
+    def _similar_dishes(self, text, filters, params, count, seen):
+        # Nearest neighbours that also pass the SQL filters; extra
+        # neighbours are fetched because the filters drop some
+        neighbours = self.vector_index.search(text, k=(count + len(seen)) * 4)
+        cutoff = max(MIN_SIMILARITY, neighbours[0][1] * RELATIVE_SIMILARITY) if neighbours else MIN_SIMILARITY
+        ids = [dish_id for dish_id, score in neighbours if score >= cutoff and dish_id not in seen]
+        if not ids:
+            return []
+        sql = _DISH_SELECT + ' WHERE d.id IN (SELECT value FROM json_each(?))'
+        sql += ''.join(' AND ' + condition for condition in filters)
+        with metrics.timer('db_query', op='similar_dishes'), self.pool.connection() as connection:
+            rows = {row[0]: row for row in connection.execute(sql, [json.dumps(ids)] + params)}
+        return [rows[dish_id] for dish_id in ids if dish_id in rows][:count]
 
     def close(self):
-        self.connection.close()
\ No newline at end of file
+        self.pool.close()
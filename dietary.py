@@ -0,0 +1,35 @@
+import numpy as np
+
+from query_parser import exclusion_mask, restriction_mask
+
+
+def dish_masks(dishes):
+    """
+    Return the restriction masks of dish dicts as an int64 array
+    Masks stored by the database ('restriction_mask') are used as they
+    are; others are computed from the name and description once and kept
+    in the dict, so filtering the same list again is a single array op.
+    """
+    for dish in dishes:
+        if dish.get('restriction_mask') is None:
+            dish['restriction_mask'] = restriction_mask(f"{dish['name']} {dish.get('description') or ''}")
+    return np.fromiter((dish['restriction_mask'] for dish in dishes), dtype=np.int64, count=len(dishes))
+
+
+def filter_dishes(dishes, exclude):
+    """
+    Return the dishes that contain none of the excluded restrictions
+    `exclude` holds restriction or diet names (Pork, Vegetarian, ...),
+    checked with one bitwise AND over every dish; any other word drops
+    the dishes whose name or description contains it.
+    """
+    dishes = list(dishes)
+    mask, words = exclusion_mask(exclude)
+    if mask and dishes:
+        keep = (dish_masks(dishes) & mask) == 0
+        dishes = [dishes[i] for i in np.flatnonzero(keep)]
+    words = [word.lower() for word in words]
+    if words:
+        dishes = [dish for dish in dishes
+                  if not any(word in f"{dish['name']} {dish.get('description') or ''}".lower() for word in words)]
+    return dishes
@@ -0,0 +1,236 @@
+"""
+Bulk-import a directory (or manifest) of PDF menus into the database
+
+PDFs are extracted in parallel, one file per worker process, and written
+to the database in batches of restaurants per transaction. Every
+committed batch is recorded in a checkpoint file, so an interrupted run
+started again with the same arguments skips the menus already imported.
+Pages identical to ones already stored for a restaurant are not
+extracted again. New dishes are embedded into the vector index the apps
+search, which a running app picks up on its next search.
+
+Without a manifest, each PDF's restaurant is named after its file name
+(chicken_rice_stall.pdf -> Chicken Rice Stall), with as many parent
+directories as it takes to tell files of the same name apart
+(stall_a/menu.pdf -> Stall A Menu). A manifest is a CSV file with the
+columns file, restaurant, location and (optionally) rating; files are
+relative to it. Two files for the same restaurant and location are an
+error, as each import replaces the restaurant's whole menu.
+
+Usage:
+    python ingest.py menus/
+    python ingest.py --manifest menus/manifest.csv --location "Toa Payoh" --workers 8
+    python ingest.py menus/ --ocr text --db grab_helper.db --checkpoint menus.checkpoint.json
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from menu_parser import (DEFAULT_WORKERS, MP_CONTEXT, OCR_DPI, extract_menu_pages, extractor_key, known_pages,
+                         page_digests, parse_menu_pages)
+
+# Restaurants written per database transaction
+BATCH_SIZE = 20
+
+OCR_MODES = {'text': False, 'ocr': True, 'fallback': 'fallback'}
+
+
+def _restaurant_name(parts):
+    # ['stall_a', 'menu'] -> 'Stall A Menu'
+    return ' '.join(' '.join(parts).replace('_', ' ').replace('-', ' ').split()).title()
+
+
+def find_menus(directory):
+    """Return (path, restaurant, location, rating) for every PDF under directory, sorted by path"""
+    paths = sorted(os.path.join(root, file_name) for root, _, files in os.walk(directory)
+                   for file_name in files if file_name.lower().endswith('.pdf'))
+    parts = {path: os.path.splitext(os.path.relpath(path, directory))[0].split(os.sep) for path in paths}
+    counts = {}  # depth -> {name: files named so}
+
+    def name(path, depth):
+        return _restaurant_name(parts[path][-depth:])
+
+    menus = []
+    for path in paths:
+        # The shortest tail of the path that no other file shares
+        for depth in range(1, len(parts[path]) + 1):
+            if depth not in counts:
+                counts[depth] = Counter(name(other, depth) for other in paths)
+            if counts[depth][name(path, depth)] == 1:
+                break
+        menus.append((path, name(path, depth), None, None))
+    return menus
+
+
+def check_duplicates(menus):
+    """Raise ValueError if two menus are for the same restaurant and location"""
+    seen = {}
+    for path, restaurant, location, _ in menus:
+        key = (restaurant, location)
+        if key in seen:
+            raise ValueError(f'{seen[key]} and {path} are both menus of {restaurant!r} ({location or "no location"})')
+        seen[key] = path
+
+
+def read_manifest(path):
+    """Return (path, restaurant, location, rating) for every row of a CSV manifest"""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    menus = []
+    for row in rows:
+        file_path = os.path.join(base, row['file'])
+        restaurant = row.get('restaurant') or os.path.splitext(os.path.basename(file_path))[0]
+        rating = float(row['rating']) if row.get('rating') else None
+        menus.append((file_path, restaurant, row.get('location') or None, rating))
+    return menus
+
+
+def file_key(path):
+    # Identifies a file's version in the checkpoint without reading it
+    stat = os.stat(path)
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+
+class Checkpoint:
+    """
+    JSON record of the menus already imported, {path: file_key}
+    Written to a temporary file and renamed into place, so a crash never
+    leaves a truncated checkpoint.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.done = json.load(f)
+
+    def is_done(self, file_path):
+        return self.done.get(os.path.abspath(file_path)) == file_key(file_path)
+
+    def mark_done(self, file_paths):
+        for file_path in file_paths:
+            self.done[os.path.abspath(file_path)] = file_key(file_path)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.done, f)
+        os.replace(tmp, self.path)
+
+
+def extract_file(path, stored, ocr, dpi):
+    """
+    Extract one PDF in a worker process
+    `stored` maps page digests to the lines already stored for the
+    restaurant with the same extractor_key; only the other pages are
+    extracted. Returns (pages {page_number: (digest, lines, extractor)},
+    dishes, pages_extracted).
+    """
+    digests = page_digests(path)
+    pages = known_pages(digests, stored, ocr)
+    missing = [number for number in digests if number not in pages]
+    if missing:
+        pages.update(extract_menu_pages(path, pages=missing, ocr=ocr, workers=1, dpi=dpi))
+    dishes = [(dish.name, dish.price_cents / 100, None, dish.page) for dish in parse_menu_pages(pages)]
+    extractor = extractor_key(ocr, dpi)
+    return {number: (digests[number], pages[number], extractor) for number in digests}, dishes, len(missing)
+
+
+def ingest(menus, db, checkpoint, ocr='fallback', workers=None, dpi=OCR_DPI, batch_size=BATCH_SIZE):
+    """
+    Extract and store every (path, restaurant, location, rating) not yet in the checkpoint
+    Returns run statistics: files, skipped, failed, pages, extracted_pages,
+    dishes and seconds.
+    """
+    stats = {'files': 0, 'skipped': 0, 'failed': 0, 'pages': 0, 'extracted_pages': 0, 'dishes': 0}
+    todo = []
+    for menu in menus:
+        if checkpoint.is_done(menu[0]):
+            stats['skipped'] += 1
+        else:
+            todo.append(menu)
+
+    start = time.perf_counter()
+    batch = []
+
+    def flush():
+        db.ingest_restaurants([restaurant for _, restaurant in batch])
+        checkpoint.mark_done([path for path, _ in batch])
+        batch.clear()
+
+    with ProcessPoolExecutor(max_workers=workers or DEFAULT_WORKERS, mp_context=MP_CONTEXT) as pool:
+        extractor = extractor_key(ocr, dpi)
+        futures = {pool.submit(extract_file, path, db.menu_pages(restaurant, location, extractor), ocr, dpi):
+                   (path, restaurant, location, rating) for path, restaurant, location, rating in todo}
+        for future in as_completed(futures):
+            path, restaurant, location, rating = futures[future]
+            try:
+                pages, dishes, extracted = future.result()
+            except Exception as e:
+                stats['failed'] += 1
+                print(f'{path}: {type(e).__name__}: {e}', file=sys.stderr)
+                continue
+            batch.append((path, (restaurant, location, {'Main Menu': dishes}, pages, rating)))
+            stats['files'] += 1
+            stats['pages'] += len(pages)
+            stats['extracted_pages'] += extracted
+            stats['dishes'] += len(dishes)
+            print(f'{path}: {len(pages)} pages, {len(dishes)} dishes', file=sys.stderr)
+            if len(batch) >= batch_size:
+                flush()
+    if batch:
+        flush()
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+
+def main():
+    from database import Database
+    from vector_index import VECTOR_INDEX_PATH, VectorIndex
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('directory', nargs='?', help='directory searched for PDF menus')
+    parser.add_argument('--manifest', help='CSV with file, restaurant, location and rating columns')
+    parser.add_argument('--location', default='', help='location of menus without one in the manifest')
+    parser.add_argument('--db', default='grab_helper.db', help='database to write to')
+    parser.add_argument('--vectors', default=VECTOR_INDEX_PATH, help='vector index directory the apps search')
+    parser.add_argument('--checkpoint', help='progress file (default: <db>.ingest.json)')
+    parser.add_argument('--ocr', choices=list(OCR_MODES), default='fallback',
+                        help='text only, OCR only, or OCR pages without text (default)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='PDFs extracted at once')
+    parser.add_argument('--dpi', type=int, default=OCR_DPI, help='OCR resolution')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='restaurants per transaction')
+    args = parser.parse_args()
+    if bool(args.directory) == bool(args.manifest):
+        parser.error('give either a directory or --manifest')
+
+    menus = read_manifest(args.manifest) if args.manifest else find_menus(args.directory)
+    menus = [(path, restaurant, location or args.location, rating) for path, restaurant, location, rating in menus]
+    try:
+        check_duplicates(menus)
+    except ValueError as e:
+        parser.error(str(e))
+    db = Database(args.db, vector_index=VectorIndex(args.vectors))
+    checkpoint = Checkpoint(args.checkpoint or args.db + '.ingest.json')
+    try:
+        stats = ingest(menus, db, checkpoint, ocr=OCR_MODES[args.ocr], workers=args.workers, dpi=args.dpi,
+                       batch_size=args.batch_size)
+    finally:
+        db.close()
+
+    seconds = max(stats['seconds'], 1e-9)
+    print(f"Imported {stats['files']} menus ({stats['skipped']} already done, {stats['failed']} failed) "
+          f"in {stats['seconds']:.1f} s")
+    print(f"{stats['pages']} pages ({stats['extracted_pages']} extracted), {stats['pages'] / seconds:.1f} pages/sec")
+    print(f"{stats['dishes']} dishes, {stats['dishes'] / seconds:.1f} dishes/sec")
+    if stats['failed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+import json
+import logging
+import threading
+import time
+
+import metrics
+from menu_parser import extract_menu_pages_cached, extractor_key, known_pages, page_digests, parse_menu_pages
+
+# Seconds an idle worker sleeps before looking for new jobs
+POLL_INTERVAL = 1.0
+
+# A running job not updated for this many seconds belongs to a worker that
+# died (e.g. the app restarted) and is queued again
+STALE_AFTER = 5 * 60
+
+# Times a job is started before it is failed instead of queued again, so a
+# PDF that crashes the process is not retried forever
+MAX_ATTEMPTS = 3
+
+JOB_COLUMNS = ('id', 'status', 'file_name', 'restaurant_name', 'location', 'rating', 'ocr',
+               'done_pages', 'total_pages', 'error', 'result', 'created_at', 'updated_at', 'session',
+               'attempts')
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """
+    Persistent queue of menu uploads processed by background threads
+    Jobs, including the uploaded PDF, are stored in the app's SQLite
+    database, so they survive Streamlit reruns, closed tabs and restarts.
+    Finished menus of jobs with a restaurant name are written to the
+    dishes table; jobs without one are only extracted.
+    """
+
+    def __init__(self, db, cache=None, threads=1, extract_workers=None):
+        self.db = db
+        self.cache = cache
+        self.extract_workers = extract_workers
+        with db.transaction() as cursor:
+            cursor.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                status TEXT NOT NULL DEFAULT 'queued',
+                                file_name TEXT NOT NULL,
+                                restaurant_name TEXT NOT NULL,
+                                location TEXT NOT NULL DEFAULT '',
+                                rating REAL,
+                                ocr TEXT NOT NULL,
+                                pdf BLOB,
+                                done_pages INTEGER NOT NULL DEFAULT 0,
+                                total_pages INTEGER,
+                                error TEXT,
+                                result TEXT,
+                                created_at REAL NOT NULL,
+                                updated_at REAL NOT NULL);''')
+            # Session that submitted the job, so its timings show up under
+            # that session on the admin page
+            db._add_column(cursor, 'jobs', 'session', 'TEXT')
+            db._add_column(cursor, 'jobs', 'attempts', 'INTEGER NOT NULL DEFAULT 0')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_session ON jobs (session, id)')
+
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._threads = [threading.Thread(target=self._run, name=f'menu-jobs-{i}', daemon=True)
+                         for i in range(threads)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, pdf_bytes, file_name, restaurant_name, location='', rating=None, ocr='fallback',
+               session=None):
+        """Queue a PDF for extraction and return the job id immediately"""
+        now = time.time()
+        with self.db.transaction() as cursor:
+            cursor.execute('INSERT INTO jobs (file_name, restaurant_name, location, rating, ocr, pdf, '
+                           'created_at, updated_at, session) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                           (file_name, restaurant_name or '', location, rating,
+                            json.dumps(ocr), bytes(pdf_bytes), now, now, session))
+            job_id = cursor.lastrowid
+        self._wakeup.set()
+        return job_id
+
+    def _row_to_job(self, row):
+        job = dict(zip(JOB_COLUMNS, row))
+        job['ocr'] = json.loads(job['ocr'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def get(self, job_id):
+        """Return a job's status, progress and result as a dict, or None"""
+        with self.db.pool.connection() as connection:
+            row = connection.execute(f'SELECT {", ".join(JOB_COLUMNS)} FROM jobs WHERE id = ?',
+                                     (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def recent(self, session, limit=10):
+        """Return the jobs most recently submitted by a session, newest first"""
+        with self.db.pool.connection() as connection:
+            rows = connection.execute(f'SELECT {", ".join(JOB_COLUMNS)} FROM jobs WHERE session = ? '
+                                      'ORDER BY id DESC LIMIT ?', (session, limit)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def _update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        with self.db.transaction() as cursor:
+            cursor.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', list(fields.values()) + [job_id])
+
+    def _claim(self):
+        # Requeue jobs abandoned by dead workers (failing those out of
+        # attempts), then take the oldest queued job. The status check in the
+        # UPDATE makes the claim safe when several threads or processes share
+        # the database.
+        now = time.time()
+        with self.db.transaction() as cursor:
+            cursor.execute("UPDATE jobs SET status = 'failed', error = ?, pdf = NULL "
+                           "WHERE status = 'running' AND updated_at < ? AND attempts >= ?",
+                           (f'Processing stopped unexpectedly {MAX_ATTEMPTS} times', now - STALE_AFTER,
+                            MAX_ATTEMPTS))
+            cursor.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running' AND updated_at < ?",
+                           (now - STALE_AFTER,))
+            row = cursor.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            cursor.execute("UPDATE jobs SET status = 'running', done_pages = 0, attempts = attempts + 1, "
+                           "updated_at = ? WHERE id = ? AND status = 'queued'", (now, row[0]))
+            if cursor.rowcount != 1:
+                return None
+            pdf = cursor.execute('SELECT pdf FROM jobs WHERE id = ?', (row[0],)).fetchone()[0]
+        job = self.get(row[0])
+        job['pdf'] = pdf
+        return job
+
+    def _run(self):
+        # Nothing may end the thread: the queue is cached for the app's
+        # lifetime, so a dead worker would leave every later upload queued
+        while not self._stopped.is_set():
+            try:
+                if not self._run_next():
+                    self._wakeup.wait(POLL_INTERVAL)
+                    self._wakeup.clear()
+            except Exception:
+                logger.exception('Menu job worker error')
+                metrics.increment('job_errors_total')
+                self._stopped.wait(POLL_INTERVAL)
+
+    def _run_next(self):
+        # Process the oldest queued job; False when there is none
+        job = self._claim()
+        if job is None:
+            return False
+        metrics.set_session(job['session'])
+        try:
+            self._process(job)
+        except Exception as e:
+            logger.exception('Menu job %s failed', job['id'])
+            self._update(job['id'], status='failed', error=str(e), pdf=None)
+        return True
+
+    def _process(self, job):
+        # The stored PDF is extracted straight from memory. Pages identical
+        # to ones of the restaurant's previous upload reuse their lines, so
+        # an updated menu only has its changed pages extracted or OCRed.
+        digests = page_digests(job['pdf'])
+        extractor = extractor_key(job['ocr'])
+        stored = self.db.menu_pages(job['restaurant_name'], job['location'], extractor) \
+            if job['restaurant_name'] else {}
+        pages = extract_menu_pages_cached(
+            job['pdf'], ocr=job['ocr'], cache=self.cache, workers=self.extract_workers,
+            progress=lambda done, total: self._update(job['id'], done_pages=done, total_pages=total),
+            known=known_pages(digests, stored, job['ocr']))
+
+        dishes = parse_menu_pages(pages)
+        rows = [(dish.name, dish.price_cents / 100, None, dish.page) for dish in dishes]
+        restaurant_id = None
+        if job['restaurant_name']:
+            # Without a name there is no restaurant to attach the dishes to;
+            # a file name is not one, as different menus share names
+            ids = self.db.ingest_restaurant(job['restaurant_name'], job['location'], {'Main Menu': rows},
+                                            pages={number: (digests[number], pages[number], extractor)
+                                                   for number in digests},
+                                            rating=job['rating'])
+            restaurant_id = ids['restaurant_id']
+        result = {
+            'restaurant_id': restaurant_id,
+            'lines': [line for number in sorted(pages) for line in pages[number]],
+            'dishes': [row[:2] for row in rows],
+        }
+        # The PDF is no longer needed once its dishes are stored
+        self._update(job['id'], status='done', result=json.dumps(result), pdf=None)
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join()
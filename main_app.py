@@ -1,68 +1,49 @@
 import streamlit as st
-import google.generativeai as genai
-from menu_parser import extract_menu_items, extract_menu_items_with_ocr
-from database import Database
+import metrics
+from ai_chatbot import SEMANTIC_TOP_K, build_history_context, build_menu_context, local_recommendations
+from database import HISTORY_PAGE_SIZE
+from query_parser import find_restrictions, parse_query
+from resources import PROGRESS_REFRESH_SECONDS, get_chatbot, get_database, get_job_queue
+from ui_text import TRANSLATIONS
 import json
+import uuid
 
 # Initialize session state
 if 'api_key_configured' not in st.session_state:
     st.session_state.api_key_configured = False
 
-if 'chat_history' not in st.session_state:
-    st.session_state.chat_history = []
-
 if 'selected_language' not in st.session_state:
     st.session_state.selected_language = 'English'
 
+if 'menu_dishes' not in st.session_state:
+    st.session_state.menu_dishes = []
+
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex[:8]
+
+# Tag every timed call made during this run with the user's session
+metrics.set_session(st.session_state.session_id)
+
 # Page configuration
 st.set_page_config(page_title="GRAB Senior Helper", layout="wide")
 
-# Language translations
-TRANSLATIONS = {
-    'English': {
-        'title': 'GRAB Senior Helper - Find Food & Restaurants',
-        'language': 'Language',
-        'api_key': 'Enter Google API Key',
-        'upload_menu': 'Upload Restaurant Menu (PDF)',
-        'dietary': 'Dietary Restrictions',
-        'price_range': 'Price Range',
-        'search': 'Search',
-        'chat': 'Chat with Assistant',
-        'results': 'Search Results'
-    },
-    'Chinese': {
-        'title': 'GRAB 老年人助手 - 查找食物和餐厅',
-        'language': '语言',
-        'api_key': '输入 Google API 密钥',
-        'upload_menu': '上传餐厅菜单 (PDF)',
-        'dietary': '饮食限制',
-        'price_range': '价格范围',
-        'search': '搜索',
-        'chat': '与助手聊天',
-        'results': '搜索结果'
-    },
-    'Malay': {
-        'title': 'GRAB Pembantu Warga Tua - Cari Makanan & Restoran',
-        'language': 'Bahasa',
-        'api_key': 'Masukkan Kunci API Google',
-        'upload_menu': 'Muat Naik Menu Restoran (PDF)',
-        'dietary': 'Sekatan Pemakanan',
-        'price_range': 'Julat Harga',
-        'search': 'Cari',
-        'chat': 'Berbual dengan Pembantu',
-        'results': 'Hasil Carian'
-    },
-    'Tamil': {
-        'title': 'GRAB மூத்த குடிமக்கள் உதவி - உணவு மற்றும் உணவகங்களைத் தேடுங்கள்',
-        'language': 'மொழி',
-        'api_key': 'Google API விசையை உள்ளிடவும்',
-        'upload_menu': 'உணவகத்தின் மெனு பதிவேற்றவும் (PDF)',
-        'dietary': 'உணவு கட்டுப்பாடுகள்',
-        'price_range': 'விலை வரம்பு',
-        'search': 'தேடு',
-        'chat': 'உதவியாளருடன் சேவையளிக்கவும்',
-        'results': 'தேடல் முடிவுகள்'
-    }
+db = get_database('grab_helper.db')
+
+# Chat history is stored under a key kept in the page URL, so it survives
+# reloads and restarts for anyone using the same link
+# The key is the only credential for that history, so it is a full
+# random UUID rather than the short session id used to tag metrics;
+# shorter keys from older links are easy to guess and get replaced
+if len(st.query_params.get('user', '')) < 32:
+    st.query_params['user'] = uuid.uuid4().hex
+user_key = st.query_params['user']
+
+# Price band (min, max) in SGD for each price range option
+PRICE_RANGES = {
+    'Any': (None, None),
+    '$': (None, 5),
+    '$$': (5, 15),
+    '$$$': (15, None)
 }
 
 def get_text(key):
@@ -72,14 +53,14 @@ def get_text(key):
 
 def configure_gemini(api_key):
     """Configure Google Gemini API"""
-    genai.configure(api_key=api_key)
+    # The chatbot is created on first use, once per API key
+    st.session_state.api_key = api_key
     st.session_state.api_key_configured = True
     st.success("API Key configured successfully!")
 
 def search_with_ai(user_query, dietary_restrictions, price_range, menu_data):
     """Use Google Gemini to find best restaurants/dishes"""
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
         prompt = f"""
 You are a helpful assistant for senior citizens looking for food in Singapore via GRAB delivery.
 Be clear, simple, and friendly.
@@ -93,10 +74,14 @@ Please recommend suitable restaurants/dishes based on the criteria.
 Consider dietary restrictions and price preferences.
 Provide: Restaurant name, dish name, price, and why it's suitable.
 """
-        response = model.generate_content(prompt)
-        return response.text
-    except Exception as e:
-        return f"Error: {str(e)}"
+        # If Gemini is down or over quota, list the matching dishes instead
+        return get_chatbot(st.session_state.api_key).generate(
+            prompt, 'search_menu_items', fallback=lambda: local_recommendations(menu_data)
+        )
+    except Exception:
+        # Details are in the metrics; seniors get a plain message
+        metrics.increment('app_errors_total', where='search_with_ai')
+        return get_text('ai_unavailable')
 
 # Main UI
 st.title(get_text('title'))
@@ -149,11 +134,27 @@ with tab1:
             st.error("Please configure API key first!")
         elif search_query:
             with st.spinner("Searching..."):
+                # Dishes with an ingredient the user cannot eat are removed
+                # before anything reaches the model; of the rest, only those
+                # closest in meaning to the request and within the price
+                # range are sent, packed into a fixed token budget
+                from dietary import filter_dishes
+                from vector_index import rank_dishes
+                excluded = find_restrictions(dietary_restrictions)
+                excluded += [item for item in parse_query(dietary_restrictions).exclude if item not in excluded]
+                min_price, max_price = PRICE_RANGES[price_range]
+                menu_data = build_menu_context(
+                    rank_dishes(search_query, filter_dishes(st.session_state.menu_dishes, excluded), SEMANTIC_TOP_K,
+                                min_price=min_price, max_price=max_price),
+                    search_query,
+                    min_price=min_price,
+                    max_price=max_price
+                )
                 result = search_with_ai(
                     search_query,
                     dietary_restrictions,
                     price_range,
-                    "Sample menu data"
+                    menu_data
                 )
                 st.subheader(get_text('results'))
                 st.write(result)
@@ -165,32 +166,56 @@ with tab2:
     
     if uploaded_file is not None:
         if st.button("Extract Menu Items"):
-            try:
-                with st.spinner("Processing PDF..."):
-                    # Save uploaded file temporarily
-                    with open('temp_menu.pdf', 'wb') as f:
-                        f.write(uploaded_file.getbuffer())
-                    
-                    # Try text extraction first, then OCR
-                    menu_items = extract_menu_items('temp_menu.pdf')
-                    if not menu_items or len(menu_items) < 5:
-                        menu_items = extract_menu_items_with_ocr('temp_menu.pdf')
-                    
-                    st.success(f"Extracted {len(menu_items)} items!")
-                    st.write("Sample items:")
-                    for item in menu_items[:10]:
-                        if item.strip():
-                            st.write(f"• {item}")
-            except Exception as e:
-                st.error(f"Error processing menu: {str(e)}")
+            # Text extraction first, OCR only for pages without text; the
+            # work happens in the background so the tab stays usable
+            # No restaurant name: the menu is only searched in this
+            # session, not stored in the shared database
+            st.session_state.menu_job = get_job_queue().submit(
+                uploaded_file.getvalue(),
+                uploaded_file.name,
+                '',
+                session=st.session_state.session_id
+            )
+    
+    def show_menu_job():
+        job = get_job_queue().get(st.session_state.menu_job)
+        if job is None or job['status'] in ('done', 'failed'):
+            # Rerun the whole page so the search tab sees the new dishes
+            st.rerun()
+        done = job['done_pages']
+        total = job['total_pages'] or 0
+        st.progress(done / total if total else 0.0, text=f"Processing PDF... page {done} of {total or '?'}")
+
+    if st.session_state.get('menu_job'):
+        job = get_job_queue().get(st.session_state.menu_job)
+        if job is None:
+            st.session_state.menu_job = None
+        elif job['status'] == 'done':
+            menu_items = [line for line in job['result']['lines'] if line.strip()]
+            st.session_state.menu_dishes = [
+                {'name': name, 'price': price, 'restaurant': job['file_name']}
+                for name, price in job['result']['dishes']
+            ]
+            st.success(f"Extracted {len(menu_items)} items!")
+            st.write("Sample items:")
+            for item in menu_items[:10]:
+                st.write(f"• {item}")
+        elif job['status'] == 'failed':
+            st.error(f"Error processing menu: {job['error']}")
+        else:
+            # Only the progress bar reruns on the timer until the job ends
+            st.fragment(show_menu_job, run_every=PROGRESS_REFRESH_SECONDS)()
 
 with tab3:
     st.header(get_text('chat'))
     
-    # Chat history display
-    for message in st.session_state.chat_history:
-        with st.chat_message(message["role"]):
-            st.write(message["content"])
+    # Show the latest turns only; older ones stay in the database
+    recent_turns = db.chat_history(user_key, HISTORY_PAGE_SIZE, kind='chat')
+    for turn in reversed(recent_turns):
+        with st.chat_message("user"):
+            st.write(turn['user'])
+        with st.chat_message("assistant"):
+            st.write(turn['bot'])
     
     # Chat input
     user_input = st.chat_input("Ask me anything...")
@@ -199,25 +224,21 @@ with tab3:
         if not st.session_state.api_key_configured:
             st.error("Please configure API key first!")
         else:
-            st.session_state.chat_history.append({"role": "user", "content": user_input})
-            
             with st.chat_message("user"):
                 st.write(user_input)
             
-            with st.spinner("Thinking..."):
-                try:
-                    model = genai.GenerativeModel('gemini-1.5-flash')
-                    response = model.generate_content(
-                        f"You are a helpful assistant for senior citizens. Answer simply and clearly. User: {user_input}"
+            try:
+                # Earlier turns are sent as a bounded window, not the whole history
+                context = build_history_context(recent_turns, db.history_summary(user_key))
+                
+                # Stream the answer so the first words appear right away
+                with st.chat_message("assistant"):
+                    assistant_response = st.write_stream(
+                        get_chatbot(st.session_state.api_key).chat_stream(user_input, context)
                     )
-                    assistant_response = response.text
-                    
-                    st.session_state.chat_history.append({
-                        "role": "assistant",
-                        "content": assistant_response
-                    })
-                    
-                    with st.chat_message("assistant"):
-                        st.write(assistant_response)
-                except Exception as e:
-                    st.error(f"Error: {str(e)}")
+                
+                # Only record the turn once the full answer has arrived
+                db.add_turn(user_key, user_input, assistant_response, kind='chat')
+            except Exception:
+                metrics.increment('app_errors_total', where='chat')
+                st.warning(get_text('ai_unavailable'))
@@ -1,35 +1,661 @@
-import pdfplumber
-import pytesseract
-from pdf2image import convert_from_path
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
+import metrics
+
+# Default size of the worker pool used for page-level extraction
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# Start method of worker processes. The apps call in from several threads,
+# and forking a multi-threaded process can copy a lock that another thread
+# holds into the child, which then hangs.
+MP_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+# Rasterization resolution for OCR; 200 DPI is enough for menu-sized text.
+# Pages are rendered in grayscale by default, a third of the size of RGB.
+OCR_DPI = 200
+
+# Bump whenever extraction output changes so stale cache entries are ignored
+EXTRACTOR_VERSION = 2
+
+# Parsed menus cache, evicted least-recently-used past CACHE_MAX_BYTES
+CACHE_PATH = 'menu_cache.db'
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Directory for the temporary copies made when a PDF held in memory must be
+# shared with worker processes or rasterized; tmpfs keeps them off the disk
+TMPFS_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Minimum blank horizontal gap (in PDF points) treated as a column gutter
+COLUMN_GAP = 24
+
+# A parsed menu row; price is in cents to avoid float rounding
+Dish = namedtuple('Dish', ['name', 'price_cents', 'section', 'page'])
+
+# A price token: "$4.50", "S$ 4", "SGD 12.00" or a bare "4.50"
+_PRICE_RE = re.compile(r'(?:S\$|SGD|\$)\s?(\d{1,3})(?:[.,](\d{2}))?(?![\d.,])'
+                       r'|(?<![\w.,])(\d{1,3})[.,](\d{2})(?![\d.,])', re.I)
+# Dot leaders, dashes and separators left between a dish name and its price
+_LEADER_RE = re.compile(r'[\s.\u2026\u00b7_:=|-]+$')
+_LETTER_RE = re.compile(r'[^\W\d_]')
+
+
+# The PDF and OCR backends are imported inside the functions that use
+# them, so importing this module (e.g. for a chat-only session) stays cheap
+
+# Every function taking `pdf_path` also accepts the PDF's bytes or a binary
+# file-like object such as a Streamlit upload, so uploads never need to be
+# written to the working directory first
+
+
+def load_pdf(source):
+    """
+    Normalise a PDF source to a path or bytes
+    Paths are returned unchanged; bytes-like objects and binary file-like
+    objects are returned as bytes.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source)
+    if isinstance(source, bytes):
+        return source
+    if isinstance(source, (bytearray, memoryview)):
+        return bytes(source)
+    if hasattr(source, 'getvalue'):
+        return source.getvalue()
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return source.read()
+
+
+def _open_pdf(source):
+    import pdfplumber
+    source = load_pdf(source)
+    return pdfplumber.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+
+
+@contextmanager
+def _worker_source(source, copy):
+    # Worker processes would each receive a pickled copy of an in-memory
+    # PDF with every batch, and pdf2image writes the whole PDF to a temp
+    # file for every window it rasterizes, so where `copy` is set it is
+    # written once to a private tmpfs file and that is opened instead
+    if not copy or not isinstance(source, bytes):
+        yield source
+        return
+    with tempfile.NamedTemporaryFile(suffix='.pdf', dir=TMPFS_DIR) as f:
+        f.write(source)
+        f.flush()
+        yield f.name
+
+
+def count_pages(pdf_path):
+    """Return the number of pages in a PDF"""
+    with _open_pdf(pdf_path) as pdf:
+        return len(pdf.pages)
+
+
+def _digest_object(obj, digest, seen, memo):
+    # Feed a PDF object into digest, following references. Streams are
+    # hashed from their raw (still compressed) bytes, and digests of shared
+    # objects such as fonts are memoised across pages.
+    from pdfminer.pdftypes import PDFObjRef, PDFStream
+
+    if isinstance(obj, PDFObjRef):
+        if obj.objid in memo:
+            digest.update(memo[obj.objid])
+            return
+        if obj.objid in seen:
+            digest.update(b'ref%d' % obj.objid)
+            return
+        seen.add(obj.objid)
+        sub = hashlib.sha256()
+        _digest_object(obj.resolve(), sub, seen, memo)
+        memo[obj.objid] = sub.digest()
+        digest.update(memo[obj.objid])
+    elif isinstance(obj, PDFStream):
+        _digest_object(obj.attrs, digest, seen, memo)
+        digest.update(obj.get_rawdata() or b'')
+    elif isinstance(obj, dict):
+        for key in sorted(obj):
+            if key != 'Parent':  # the page tree, shared by every page
+                digest.update(str(key).encode('utf-8'))
+                _digest_object(obj[key], digest, seen, memo)
+    elif isinstance(obj, (list, tuple)):
+        digest.update(b'[')
+        for item in obj:
+            _digest_object(item, digest, seen, memo)
+        digest.update(b']')
+    else:
+        digest.update(repr(obj).encode('utf-8'))
+
+
+def page_digests(pdf_path):
+    """
+    Return {page_number: SHA-256 hex digest} of each page's content
+    A digest covers the page's content streams, images, fonts and page
+    size, so it changes exactly when the page would extract differently.
+    Nothing is rendered or extracted, which makes it cheap to compute.
+    """
+    memo = {}
+    digests = {}
+    with _open_pdf(pdf_path) as pdf:
+        for number, page in enumerate(pdf.pages, 1):
+            digest = hashlib.sha256()
+            _digest_object(page.page_obj.attrs, digest, set(), memo)
+            digests[number] = digest.hexdigest()
+    return digests
+
+
+def extractor_key(ocr, dpi=OCR_DPI, grayscale=True):
+    """
+    Identify the extraction settings and EXTRACTOR_VERSION that produced
+    a page's lines, stored with them so they are only reused for an
+    extraction that would produce the same lines
+    """
+    settings = {'ocr': ocr, 'version': EXTRACTOR_VERSION}
+    if ocr:
+        settings.update(dpi=dpi, grayscale=grayscale)
+    return json.dumps(settings, sort_keys=True)
+
+
+def known_pages(digests, stored, ocr):
+    """
+    Return {page_number: lines} of the pages whose lines can be reused
+    `digests` comes from page_digests and `stored` maps digests to lines
+    extracted with the same extractor_key. With OCR on, pages stored
+    without any text are extracted again rather than trusted.
+    """
+    pages = {}
+    for number, digest in digests.items():
+        lines = stored.get(digest)
+        if lines is not None and (lines or not ocr):
+            pages[number] = lines
+    return pages
+
+
+def _split_lines(text):
+    # Split items by newline
+    return text.split('\n') if text else []
+
+
+def _column_bounds(words, width):
+    # Find x ranges separated by vertical gutters: runs at least COLUMN_GAP
+    # wide crossed by at most one word, so a centred title or banner does
+    # not hide the gutter beneath it
+    covered = [0] * (int(width) + 2)
+    for word in words:
+        for x in range(max(0, int(word['x0'])), min(len(covered), int(word['x1']) + 1)):
+            covered[x] += 1
+
+    bounds = []
+    start = None
+    gap = 0
+    for x, count in enumerate(covered):
+        if count > 1:
+            if start is None:
+                start = x
+            elif gap >= COLUMN_GAP:
+                bounds.append((start, x - gap))
+                start = x
+            gap = 0
+        elif start is not None:
+            gap += 1
+    if start is not None:
+        bounds.append((start, len(covered)))
+    return bounds
+
+
+def _words_to_lines(words, tolerance=3):
+    # Group words sharing a baseline into lines, top to bottom
+    lines = []
+    for word in sorted(words, key=lambda w: (round(w['top']), w['x0'])):
+        if lines and abs(lines[-1][0] - word['top']) <= tolerance:
+            lines[-1][1].append(word)
+        else:
+            lines.append((word['top'], [word]))
+    return [' '.join(w['text'] for w in sorted(line, key=lambda w: w['x0'])) for _, line in lines]
+
+
+def _page_text_lines(page):
+    # Read multi-column pages column by column using word coordinates;
+    # single-column pages keep pdfplumber's own text layout
+    words = page.extract_words()
+    bounds = _column_bounds(words, page.width)
+    if len(bounds) < 2:
+        return _split_lines(page.extract_text())
+
+    # Split at the middle of each gutter
+    splits = [(left[1] + right[0]) / 2 for left, right in zip(bounds, bounds[1:])]
+    columns = [[] for _ in bounds]
+    for word in words:
+        middle = (word['x0'] + word['x1']) / 2
+        columns[sum(1 for split in splits if middle > split)].append(word)
+    lines = []
+    for column in columns:
+        column_lines = _words_to_lines(column)
+        # A column made mostly of bare prices is the right-aligned price
+        # list of a single-column menu, not a real column
+        if sum(1 for line in column_lines if _LETTER_RE.search(line)) * 2 < len(column_lines):
+            return _split_lines(page.extract_text())
+        lines.extend(column_lines)
+    return lines
+
+
+def _extract_text_pages(pdf_path, page_numbers):
+    # Extract text from a batch of pages (1-based) with pdfplumber
+    results = []
+    with _open_pdf(pdf_path) as pdf:
+        for number in page_numbers:
+            results.append((number, _page_text_lines(pdf.pages[number - 1])))
+    return results
+
+
+def _page_windows(page_numbers, window):
+    # Group sorted pages into runs of at most `window` consecutive pages
+    run = []
+    for number in sorted(page_numbers):
+        if run and (number != run[-1] + 1 or len(run) >= window):
+            yield run
+            run = []
+        run.append(number)
+    if run:
+        yield run
+
+
+def iter_ocr_pages(pdf_path, pages=None, dpi=OCR_DPI, grayscale=True, window=1):
+    """
+    Rasterize and OCR a PDF a few pages at a time
+    Yields (page_number, lines) in page order. Only `window` page images
+    are held in memory at once, so peak memory does not grow with the
+    length of the document.
+    """
+    import pytesseract
+    from pdf2image import convert_from_bytes, convert_from_path
+
+    pdf_path = load_pdf(pdf_path)
+    convert = convert_from_bytes if isinstance(pdf_path, bytes) else convert_from_path
+    if pages is None:
+        pages = range(1, count_pages(pdf_path) + 1)
+    for run in _page_windows(pages, max(1, window)):
+        images = convert(pdf_path, dpi=dpi, grayscale=grayscale, first_page=run[0], last_page=run[-1])
+        for number, image in zip(run, images):
+            yield number, _split_lines(pytesseract.image_to_string(image))
+            image.close()
+        del images
+
+
+def iter_ocr_lines(pdf_path, first_page=None, last_page=None, dpi=OCR_DPI, grayscale=True, window=1):
+    """Yield OCR'd lines from a page range (1-based, inclusive) one page at a time"""
+    first_page = first_page or 1
+    if last_page is None:
+        last_page = count_pages(pdf_path)
+    for _, lines in iter_ocr_pages(pdf_path, range(first_page, last_page + 1), dpi, grayscale, window):
+        for line in lines:
+            yield line
+
+
+def _ocr_pages(pdf_path, page_numbers, dpi=OCR_DPI, grayscale=True):
+    # Rasterize and OCR a batch of pages (1-based), one page at a time
+    return list(iter_ocr_pages(pdf_path, page_numbers, dpi=dpi, grayscale=grayscale))
 
-def extract_menu_items(pdf_path):
-    # Extract text from PDF using pdfplumber
-    menu_items = []
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            text = page.extract_text()  # Extract text from each page
-            if text:
-                menu_items.extend(text.split('\n'))  # Split items by newline
-    
-    return menu_items
 
+def _batches(page_numbers, workers):
+    # Split pages into contiguous batches, a few per worker so that slow
+    # pages do not leave the other workers idle
+    page_numbers = list(page_numbers)
+    batch_size = max(1, len(page_numbers) // (workers * 4))
+    return [page_numbers[i:i + batch_size] for i in range(0, len(page_numbers), batch_size)]
 
-def extract_menu_items_with_ocr(pdf_path):
-    # Extract images from PDF then perform OCR
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _process_pool(workers):
+    # Worker pools are kept for the life of the process and shared by every
+    # extraction, so each upload does not start its own processes. Pools
+    # are keyed by the configured worker count, not by how many pages a
+    # document has, so there is one per setting in use.
+    with _pools_lock:
+        if workers not in _pools:
+            _pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=MP_CONTEXT)
+        return _pools[workers]
+
+
+def _run_pages(func, pdf_path, page_numbers, workers, progress=None):
+    # Run a page extractor over a process pool, returning {page: lines}.
+    # progress(pages_done) is called as batches finish.
+    page_numbers = list(page_numbers)
+    if workers is None:
+        workers = DEFAULT_WORKERS
+    workers = max(1, workers)
+    # Short documents use fewer processes of the same pool
+    active = min(workers, len(page_numbers))
+
+    if active <= 1 and progress is None:
+        return dict(func(pdf_path, page_numbers)) if page_numbers else {}
+
+    pages = {}
+    if active <= 1:
+        for batch in _batches(page_numbers, 1):
+            pages.update(func(pdf_path, batch))
+            progress(len(pages))
+        return pages
+
+    pool = _process_pool(workers)
+    futures = [pool.submit(func, pdf_path, batch) for batch in _batches(page_numbers, active)]
+    try:
+        for future in as_completed(futures):
+            pages.update(future.result())
+            if progress is not None:
+                progress(len(pages))
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); later extractions get a new pool
+        with _pools_lock:
+            if _pools.get(workers) is pool:
+                del _pools[workers]
+        raise
+    finally:
+        # The pool outlives this call, so batches left after an error are dropped
+        for future in futures:
+            future.cancel()
+    return pages
+
+
+def extract_menu_pages(pdf_path, pages=None, ocr=False, workers=None, dpi=OCR_DPI, grayscale=True,
+                       progress=None):
+    """
+    Extract lines from each page of a PDF in parallel
+    Returns {page_number: [lines]} for the requested pages (1-based).
+    `ocr` is False (text only), True (OCR only) or 'fallback' (OCR only
+    the pages that produced no text, e.g. scanned pages).
+    `progress(done, total)` is called as pages finish; in fallback mode
+    the total grows by the number of pages that need OCR.
+    """
+    pdf_path = load_pdf(pdf_path)
+    if pages is None:
+        pages = range(1, count_pages(pdf_path) + 1)
+    pages = list(pages)
+    if workers is None:
+        workers = DEFAULT_WORKERS
+    with _worker_source(pdf_path, min(workers, len(pages)) > 1 or ocr is True) as source:
+        return _extract_pages(source, pages, ocr, workers, dpi, grayscale, progress)
+
+
+def _extract_pages(pdf_path, pages, ocr, workers, dpi, grayscale, progress):
+    # Body of extract_menu_pages once the source is readable by the workers
+    def report(total, offset=0):
+        if progress is None:
+            return None
+        return lambda done: progress(offset + done, total)
+
+    ocr_func = partial(_ocr_pages, dpi=dpi, grayscale=grayscale)
+    if ocr == 'fallback':
+        result = _timed_run('text', _extract_text_pages, pdf_path, pages, workers, report(len(pages)))
+        empty = [number for number, lines in result.items() if not any(line.strip() for line in lines)]
+        if empty:
+            # Still bytes only when a single process extracted the text
+            with _worker_source(pdf_path, True) as source:
+                result.update(_timed_run('ocr', ocr_func, source, empty, workers,
+                                         report(len(pages) + len(empty), len(pages))))
+        return result
+    if ocr:
+        return _timed_run('ocr', ocr_func, pdf_path, pages, workers, report(len(pages)))
+    return _timed_run('text', _extract_text_pages, pdf_path, pages, workers, report(len(pages)))
+
+
+def _timed_run(mode, func, pdf_path, pages, workers, progress):
+    # Worker processes have their own metrics, so pages are timed here
+    # as a whole per extraction mode
+    with metrics.timer('menu_extract', mode=mode):
+        result = _run_pages(func, pdf_path, pages, workers, progress)
+    metrics.increment('menu_pages_total', len(pages), mode=mode)
+    return result
+
+
+def _flatten(pages):
+    # Join per-page lines back together in page order
     menu_items = []
-    images = convert_from_path(pdf_path)
-    for image in images:
-        text = pytesseract.image_to_string(image)  # use OCR to extract text from image
-        menu_items.extend(text.split('\n'))  # Split items by newline
-    
+    for number in sorted(pages):
+        menu_items.extend(pages[number])
     return menu_items
 
 
-# Example usage:
+def extract_menu_items(pdf_path, workers=None):
+    # Extract text from PDF using pdfplumber
+    return _flatten(extract_menu_pages(pdf_path, workers=workers))
+
+
+def extract_menu_items_with_ocr(pdf_path, workers=None, first_page=None, last_page=None,
+                                dpi=OCR_DPI, grayscale=True):
+    # Extract images from PDF then perform OCR, optionally on a page range
+    pdf_path = load_pdf(pdf_path)
+    pages = None
+    if first_page is not None or last_page is not None:
+        if last_page is None:
+            last_page = count_pages(pdf_path)
+        pages = range(first_page or 1, last_page + 1)
+    return _flatten(extract_menu_pages(pdf_path, pages=pages, ocr=True, workers=workers,
+                                       dpi=dpi, grayscale=grayscale))
+
+
+def extract_menu_items_with_fallback(pdf_path, workers=None, dpi=OCR_DPI, grayscale=True):
+    """
+    Extract text from every page, then OCR only the pages that
+    produced no text (e.g. scanned pages in a mixed document)
+    """
+    return _flatten(extract_menu_pages(pdf_path, ocr='fallback', workers=workers,
+                                       dpi=dpi, grayscale=grayscale))
+
+
+def _is_section(line):
+    # Short lines with no price and no sentence punctuation read as headings
+    words = line.split()
+    return 0 < len(words) <= 4 and _LETTER_RE.search(line) and not line.endswith(('.', ',', ';'))
+
+
+def parse_dish_line(line, section=None, page=None):
+    """Parse a single "Chicken Rice ....... $4.50" line into a Dish, or None"""
+    match = _PRICE_RE.search(line)
+    if match is None:
+        return None
+    name = _LEADER_RE.sub('', line[:match.start()]).strip()
+    if not _LETTER_RE.search(name):
+        return None
+    dollars, cents = (match.group(1), match.group(2)) if match.group(1) else (match.group(3), match.group(4))
+    return Dish(name, int(dollars) * 100 + int(cents or 0), section, page)
+
+
+def parse_menu_lines(lines, page=None, section=None):
+    """
+    Turn raw menu lines into Dish records
+    Lines without a price that look like headings become the section of
+    the dishes that follow; everything else without a price is skipped.
+    """
+    dishes = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        dish = parse_dish_line(line, section, page)
+        if dish is not None:
+            dishes.append(dish)
+        elif _is_section(line):
+            section = line
+    return dishes
+
+
+def parse_menu_pages(pages):
+    """Parse {page_number: [lines]} into Dish records in page order"""
+    dishes = []
+    section = None
+    for number in sorted(pages):
+        page_dishes = parse_menu_lines(pages[number], page=number, section=section)
+        if page_dishes:
+            section = page_dishes[-1].section
+        dishes.extend(page_dishes)
+    return dishes
+
+
+def file_digest(pdf_path):
+    """Return the SHA-256 hex digest of a file's bytes (or of a PDF held in memory)"""
+    pdf_path = load_pdf(pdf_path)
+    if isinstance(pdf_path, bytes):
+        return hashlib.sha256(pdf_path).hexdigest()
+    digest = hashlib.sha256()
+    with open(pdf_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MenuCache:
+    """
+    Persistent, content-addressed cache of extracted menu items
+    Entries are keyed by the PDF's hash plus the extractor version and
+    settings, and evicted least-recently-used once the stored items
+    exceed max_bytes.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        with self._connect() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS menu_cache (
+                                key TEXT PRIMARY KEY,
+                                items TEXT NOT NULL,
+                                size INTEGER NOT NULL,
+                                last_access REAL NOT NULL);''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_menu_cache_access ON menu_cache (last_access)')
+
+    @contextmanager
+    def _connect(self):
+        # A short-lived connection per call keeps the cache safe to share
+        # between Streamlit sessions running on different threads
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(digest, **settings):
+        settings['version'] = EXTRACTOR_VERSION
+        return digest + ':' + json.dumps(settings, sort_keys=True)
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute('SELECT items FROM menu_cache WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE menu_cache SET last_access = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, items):
+        data = json.dumps(items)
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO menu_cache (key, items, size, last_access) VALUES (?, ?, ?, ?)',
+                         (key, data, len(data), time.time()))
+            self._evict(conn)
+
+    def _evict(self, conn):
+        # Drop least recently used entries until the cache fits max_bytes
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM menu_cache').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = conn.execute('SELECT key, size FROM menu_cache ORDER BY last_access').fetchall()
+        stale = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        conn.executemany('DELETE FROM menu_cache WHERE key = ?', stale)
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM menu_cache')
+
+
+def extract_menu_pages_cached(pdf_path, ocr='fallback', cache=None, workers=None,
+                              dpi=OCR_DPI, grayscale=True, progress=None, known=None):
+    """
+    Extract {page_number: [lines]}, reusing a previous result for identical PDFs
+    `ocr` takes the same values as in extract_menu_pages. `known` maps
+    page numbers to lines already extracted from identical pages (see
+    page_digests), e.g. by an earlier version of the same menu; only the
+    other pages are extracted.
+    """
+    if cache is None:
+        cache = MenuCache()
+    pdf_path = load_pdf(pdf_path)
+    settings = {'ocr': ocr}
+    if ocr:
+        settings.update(dpi=dpi, grayscale=grayscale)
+    key = MenuCache.make_key(file_digest(pdf_path), **settings)
+
+    pages = cache.get(key)
+    metrics.increment('menu_cache_total', result='miss' if pages is None else 'hit')
+    if pages is not None:
+        # JSON object keys come back as strings
+        pages = {int(number): lines for number, lines in pages.items()}
+        if progress is not None:
+            progress(len(pages), len(pages))
+        return pages
+
+    pages = dict(known or {})
+    missing = [number for number in range(1, count_pages(pdf_path) + 1) if number not in pages]
+    metrics.increment('menu_pages_reused_total', len(pages))
+    if missing:
+        # Reused pages count as done, so a 30-page menu with 2 changed
+        # pages reports 28 of 30 rather than 0 of 2
+        reused = len(pages)
+        report = None
+        if progress is not None:
+            def report(done, total):
+                progress(reused + done, reused + total)
+        pages.update(extract_menu_pages(pdf_path, pages=missing, ocr=ocr, workers=workers, dpi=dpi,
+                                        grayscale=grayscale, progress=report))
+    elif progress is not None:
+        progress(len(pages), len(pages))
+    cache.put(key, pages)
+    return pages
+
+
+def extract_menu_items_cached(pdf_path, ocr='fallback', cache=None, workers=None,
+                              dpi=OCR_DPI, grayscale=True):
+    """Extract menu items, reusing a previous result for identical PDFs"""
+    return _flatten(extract_menu_pages_cached(pdf_path, ocr=ocr, cache=cache, workers=workers,
+                                              dpi=dpi, grayscale=grayscale))
+
+
+def extract_dishes(pdf_path, ocr='fallback', cache=None, workers=None, dpi=OCR_DPI, grayscale=True):
+    """Extract structured Dish records (name, price_cents, section, page) from a PDF menu"""
+    return parse_menu_pages(extract_menu_pages_cached(pdf_path, ocr=ocr, cache=cache, workers=workers,
+                                                      dpi=dpi, grayscale=grayscale))
+
+
+# Print the dishes found in the PDFs named on the command line; ingest.py
+# stores a whole directory of menus in the database
 if __name__ == '__main__':
-    pdf_path = 'path_to_your_pdf.pdf'  # Update this with your PDF file path
-    items = extract_menu_items(pdf_path)
-    ocr_items = extract_menu_items_with_ocr(pdf_path)
-    print("Menu items from text:", items)
-    print("Menu items from OCR:", ocr_items)
\ No newline at end of file
+    import sys
+
+    for pdf_path in sys.argv[1:]:
+        print(pdf_path)
+        for dish in parse_menu_pages(extract_menu_pages(pdf_path, ocr='fallback')):
+            print(f"  p{dish.page:<3} {dish.section or '':<20} {dish.name:<40} ${dish.price_cents / 100:.2f}")
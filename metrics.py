@@ -0,0 +1,180 @@
+import bisect
+import contextvars
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds: latencies in seconds, sizes in tokens/rows
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 50000)
+
+# Timed calls kept for the per-session breakdown on the admin page
+RECENT_EVENTS = 2000
+
+# Session the current call belongs to. Context variables follow the call
+# into the Gemini client's event loop, so model calls are attributed to
+# the Streamlit session that made them.
+_session = contextvars.ContextVar('metrics_session', default=None)
+
+
+def set_session(session_id):
+    """Attribute calls made from the current thread/task to a user session"""
+    _session.set(session_id)
+
+
+def _series_key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the q-th observation
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+
+class Registry:
+    """
+    Process-wide counters and histograms, plus a ring buffer of recent
+    timed calls tagged with the session that made them
+    Recording is a dict lookup under a lock, cheap enough for every call.
+    """
+
+    def __init__(self, recent_events=RECENT_EVENTS):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._events = deque(maxlen=recent_events)
+
+    def increment(self, name, value=1, **labels):
+        key = _series_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = _series_key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Time a block into the `name`_seconds histogram
+        Exceptions are counted in `name`_errors_total and re-raised.
+        """
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = type(e).__name__
+            self.increment(f'{name}_errors_total', error=error, **labels)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(f'{name}_seconds', elapsed, **labels)
+            with self._lock:
+                self._events.append({'time': time.time(), 'session': _session.get(), 'name': name,
+                                     'labels': labels, 'seconds': elapsed, 'error': error})
+
+    def events(self, session=None):
+        """Recent timed calls, newest first, optionally for one session"""
+        with self._lock:
+            events = list(self._events)
+        events.reverse()
+        if session is not None:
+            events = [event for event in events if event['session'] == session]
+        return events
+
+    def sessions(self):
+        """Sessions with recent calls, most recently active first"""
+        seen = []
+        for event in self.events():
+            if event['session'] is not None and event['session'] not in seen:
+                seen.append(event['session'])
+        return seen
+
+    def snapshot(self):
+        """Return every series as a list of dicts, for JSON export and the admin page"""
+        series = []
+        with self._lock:
+            for (name, labels), value in sorted(self._counters.items()):
+                series.append({'type': 'counter', 'name': name, 'labels': dict(labels), 'value': value})
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                series.append({
+                    'type': 'histogram', 'name': name, 'labels': dict(labels),
+                    'count': histogram.count, 'sum': histogram.sum,
+                    'p50': histogram.quantile(0.5), 'p95': histogram.quantile(0.95),
+                    'buckets': dict(zip([str(bound) for bound in histogram.buckets] + ['+Inf'],
+                                        histogram.counts)),
+                })
+        return series
+
+    def json_lines(self):
+        """Export a snapshot as JSON lines, one series per line"""
+        now = time.time()
+        return ''.join(json.dumps(dict(series, time=now)) + '\n' for series in self.snapshot())
+
+    def prometheus_text(self):
+        """Export a snapshot in the Prometheus text exposition format"""
+        lines = []
+        typed = set()
+        for series in self.snapshot():
+            name = series['name']
+            if name not in typed:
+                lines.append(f"# TYPE {name} {series['type']}")
+                typed.add(name)
+            labels = series['labels']
+            if series['type'] == 'counter':
+                lines.append(f"{name}{_format_labels(labels)} {series['value']}")
+                continue
+            cumulative = 0
+            for bound, count in series['buckets'].items():
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(dict(labels, le=bound))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {series['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {series['count']}")
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._events.clear()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+# The registry shared by the whole process
+REGISTRY = Registry()
+increment = REGISTRY.increment
+observe = REGISTRY.observe
+timer = REGISTRY.timer
@@ -0,0 +1,330 @@
+import re
+import unicodedata
+from collections import namedtuple
+
+# Result of parsing a food request locally. dish is an English dish
+# keyword, max_price is in SGD, exclude uses the restriction names shown
+# in the app (Pork, Beef, ...), confidence is between 0 and 1.
+ParsedQuery = namedtuple('ParsedQuery', ['dish', 'max_price', 'exclude', 'language', 'confidence'])
+
+# Below this confidence a request should be translated by the LLM instead
+CONFIDENCE_THRESHOLD = 0.6
+
+# What "cheap" means at a hawker centre, in SGD
+CHEAP_PRICE = 5
+
+# English dish keyword -> how it is written in English, Chinese, Malay and Tamil
+DISHES = {
+    'chicken rice': ['chicken rice', '鸡饭', '雞飯', 'nasi ayam', 'கோழி சோறு', 'சிக்கன் ரைஸ்'],
+    'duck rice': ['duck rice', '鸭饭', 'nasi itik', 'வாத்து சோறு'],
+    'fried rice': ['fried rice', '炒饭', 'nasi goreng', 'பொரித்த சோறு', 'ஃபிரைட் ரைஸ்'],
+    'nasi lemak': ['nasi lemak', '椰浆饭', 'நாசி லெமாக்'],
+    'fish soup': ['fish soup', '鱼汤', '鱼片汤', 'sup ikan', 'மீன் சூப்'],
+    'laksa': ['laksa', '叻沙', 'லக்சா'],
+    'char kway teow': ['char kway teow', '炒粿条', 'kuey teow goreng', 'சார் குவே தியோ'],
+    'wanton mee': ['wanton mee', 'wonton noodles', '云吞面', 'mee wantan'],
+    'mee goreng': ['mee goreng', '马来炒面', 'மீ கோரேங்'],
+    'noodles': ['noodles', 'noodle', '面', '麵', 'mee', 'mi', 'நூடுல்ஸ்'],
+    'porridge': ['porridge', 'congee', '粥', 'bubur', 'கஞ்சி'],
+    'prata': ['roti prata', 'prata', '印度煎饼', 'பரோட்டா'],
+    'dosa': ['dosa', 'thosai', '印度薄饼', 'தோசை'],
+    'curry': ['curry', '咖喱', 'kari', 'கறி'],
+    'soup': ['soup', '汤', 'sup', 'சூப்'],
+    'rice': ['rice', '饭', '飯', 'nasi', 'சோறு', 'சாதம்'],
+    'chicken': ['chicken', '鸡', 'ayam', 'கோழி', 'சிக்கன்'],
+    'fish': ['fish', '鱼', 'ikan', 'மீன்'],
+    'vegetables': ['vegetables', 'vegetable', '青菜', '蔬菜', 'sayur', 'காய்கறி'],
+    'tofu': ['tofu', 'beancurd', '豆腐', 'tauhu', 'டோஃபு'],
+    'egg': ['egg', '鸡蛋', '雞蛋', '蛋', 'telur', 'முட்டை'],
+}
+
+# Restriction -> ingredients that trigger it, in all four languages.
+# Longer terms win over shorter ones they contain (牛奶 is Dairy, not Beef).
+RESTRICTIONS = {
+    'Pork': ['pork', 'char siew', 'bacon', 'ham', 'lard', 'babi', '猪肉', '猪', '叉烧', 'பன்றி இறைச்சி', 'பன்றி'],
+    'Beef': ['beef', 'daging lembu', 'lembu', '牛肉', '牛', 'மாட்டிறைச்சி', 'மாட்டு'],
+    'Seafood': ['seafood', 'fish', 'prawn', 'prawns', 'shrimp', 'crab', 'squid', 'clam', 'oyster', 'makanan laut',
+                'ikan', 'udang', 'ketam', 'sotong', '海鲜', '鱼', '虾', '蟹', '鱿鱼', 'கடல் உணவு', 'மீன்', 'இறால்',
+                'நண்டு'],
+    'Nuts': ['nuts', 'nut', 'peanut', 'peanuts', 'cashew', 'almond', 'kacang', '花生', '坚果', '腰果',
+             'வேர்க்கடலை', 'கடலை', 'முந்திரி'],
+    'Dairy': ['dairy', 'milk', 'cheese', 'butter', 'cream', 'susu', 'keju', 'mentega', '牛奶', '奶酪', '芝士',
+              '黄油', '奶', 'பால்', 'வெண்ணெய்', 'சீஸ்'],
+    'Spicy': ['spicy', 'chilli', 'chili', 'sambal', 'pedas', 'cili', '辣', 'காரம்', 'மிளகாய்'],
+    'Meat': ['meat', 'chicken', 'duck', 'mutton', 'lamb', 'goat', 'goose', 'satay', 'daging', 'ayam', 'itik',
+             'kambing', '鸡', '雞', '鸭', '鴨', '鹅', '羊', 'இறைச்சி', 'கோழி', 'சிக்கன்', 'வாத்து', 'ஆட்டு',
+             'மட்டன்'],
+}
+
+# Words that contain an ingredient term without being that ingredient
+# (鸡蛋 is egg, not chicken); they match no restriction
+NOT_INGREDIENTS = ['鸡蛋', '雞蛋', '鸭蛋', '鴨蛋', 'nutmeg', 'butterfly', 'coconut', 'meatless']
+
+# Latin ingredient terms this long also match as the start of a longer
+# word, so compounds such as "fishball" and "porkchop" are caught. Shorter
+# ones ("ham", "nut") would match unrelated words and must stand alone.
+PREFIX_MIN_LENGTH = 4
+
+# Bump when ingredients are matched differently, so stored masks are redone
+LEXICON_VERSION = 2
+
+# Bit of each restriction in a dish's restriction mask
+RESTRICTION_BITS = {name: 1 << i for i, name in enumerate(RESTRICTIONS)}
+
+# Words that imply several restrictions on their own
+DIETS = {
+    'Pork': ['halal', '清真', 'ஹலால்'],
+    'Vegetarian': ['vegetarian', '素食', '吃素', 'sayuran sahaja', 'சைவ'],
+}
+DIET_RESTRICTIONS = {
+    'Pork': ['Pork'],
+    'Vegetarian': ['Pork', 'Beef', 'Seafood', 'Meat'],
+}
+
+CHEAP_WORDS = ['not expensive', 'inexpensive', 'cheap', 'affordable', 'budget', '便宜', '不贵', '实惠',
+               'tidak mahal', 'tak mahal', 'murah', 'jimat', 'மலிவு', 'விலை குறைவு']
+
+# Negations written before the ingredient (English, Malay, Chinese) and
+# after it (Tamil)
+NEGATIONS_BEFORE = ['no', 'without', 'not', "don't", 'dont', 'avoid', 'allergic to', 'except', 'no more',
+                    'tanpa', 'tak', 'tidak', 'jangan', 'bukan', 'elak', 'alah',
+                    '不要', '不吃', '不加', '没有', '无', '免', '别', '忌', '过敏']
+NEGATIONS_AFTER = ['இல்லாமல்', 'வேண்டாம்', 'இல்லை', 'தவிர்']
+
+# A dish or ingredient mentioned in a request. dish is a DISHES keyword or
+# None; restriction is set for ingredients and for dishes that are one
+# ingredient ("no chicken").
+_Term = namedtuple('_Term', ['start', 'end', 'dish', 'restriction'])
+
+# Common filler so that "I want ..." in any language counts as understood
+FILLER = ['i want', 'i would like', 'i like', 'can i have', 'give me', 'please', 'something', 'some', 'want',
+          'and', 'or', 'but', 'with', 'food', 'eat', 'a', 'an', 'the', 'me', 'i', 'to',
+          '我想要', '我要', '我想吃', '想吃', '请', '给我', '和', '或', '吃', '的', '一个', '要',
+          'saya', 'mahu', 'nak', 'hendak', 'mau', 'tolong', 'dan', 'atau', 'dengan', 'makan', 'yang',
+          'எனக்கு', 'வேண்டும்', 'தயவு செய்து', 'மற்றும்', 'சாப்பிட']
+
+# Clause boundaries end the scope of a negation
+_CLAUSE_RE = re.compile(r'[,.;!?，。；！？]|\bbut\b|\btapi\b|但是|ஆனால்')
+_MAX_PRICE_RES = [
+    re.compile(r'(?:under|below|less than|max|within|at most|bawah|kurang dari|tak lebih|少于|不超过|低于)'
+               r'\s*(?:s?\$|sgd)?\s*(\d+(?:\.\d+)?)'),
+    re.compile(r'(\d+(?:\.\d+)?)\s*(?:块钱|块|元|dollars?|ringgit)?\s*(?:以下|以内|or less|ke bawah)'),
+    re.compile(r'(\d+(?:\.\d+)?)\s*\S*\s*(?:க்குள்|கீழ்)'),
+]
+_LATIN_RE = re.compile(r'[a-z]')
+
+
+def _normalize(text):
+    return unicodedata.normalize('NFKC', text).lower().strip()
+
+
+def _compile(terms, prefix=False):
+    # Longest alternatives first; Latin terms must match whole words (or,
+    # with `prefix`, the start of one), Chinese and Tamil terms match
+    # anywhere since they are not spaced
+    patterns = []
+    for term in sorted(terms, key=len, reverse=True):
+        escaped = re.escape(term)
+        if not _LATIN_RE.match(term):
+            patterns.append(escaped)
+        elif prefix and len(term) >= PREFIX_MIN_LENGTH:
+            patterns.append(r'\b' + escaped)
+        else:
+            patterns.append(r'\b' + escaped + r'\b')
+    return re.compile('|'.join(patterns))
+
+
+def _lexicon(groups, prefix=False):
+    # Compile {label: [terms]} into one pattern and a term -> label lookup
+    lookup = {}
+    for label, terms in groups.items():
+        for term in terms:
+            lookup[term] = label
+    return _compile(lookup, prefix), lookup
+
+
+_DISH_RE, _DISH_LOOKUP = _lexicon(DISHES)
+_RESTRICTION_RE, _RESTRICTION_LOOKUP = _lexicon({**RESTRICTIONS, None: NOT_INGREDIENTS}, prefix=True)
+_DIET_RE, _DIET_LOOKUP = _lexicon(DIETS)
+_CHEAP_RE = _compile(CHEAP_WORDS)
+_NEGATION_BEFORE_RE = _compile(NEGATIONS_BEFORE)
+_NEGATION_AFTER_RE = _compile(NEGATIONS_AFTER)
+_FILLER_RE = _compile(FILLER)
+
+# Lower-cased restriction and diet names -> the bits they exclude (the
+# diet keyed 'Pork' in DIETS is halal)
+_EXCLUSION_BITS = dict(
+    {name.lower(): bit for name, bit in RESTRICTION_BITS.items()},
+    vegetarian=sum(RESTRICTION_BITS[name] for name in DIET_RESTRICTIONS['Vegetarian']),
+    halal=sum(RESTRICTION_BITS[name] for name in DIET_RESTRICTIONS['Pork']),
+)
+
+
+def detect_language(text):
+    """Guess english/chinese/malay/tamil from the script and a few Malay words"""
+    for char in text:
+        if '一' <= char <= '鿿':
+            return 'chinese'
+        if '஀' <= char <= '௿':
+            return 'tamil'
+    if re.search(r'\b(?:saya|nak|mahu|tanpa|murah|tak|tidak|nasi|makan|dengan|sahaja)\b', _normalize(text)):
+        return 'malay'
+    return 'english'
+
+
+def find_dishes(text):
+    """Return the English dish keywords mentioned in text, in any of the four languages"""
+    normalized = _normalize(text)
+    found = []
+    for match in _DISH_RE.finditer(normalized):
+        dish = _DISH_LOOKUP[match.group()]
+        if dish not in found:
+            found.append(dish)
+    return found
+
+
+def find_restrictions(text):
+    """Return the restrictions (Pork, Beef, ...) whose ingredients text mentions, ignoring negation"""
+    normalized = _normalize(text)
+    found = []
+    for match in _RESTRICTION_RE.finditer(normalized):
+        restriction = _RESTRICTION_LOOKUP[match.group()]
+        if restriction is not None and restriction not in found:
+            found.append(restriction)
+    return found
+
+
+def restriction_mask(text):
+    """Return the RESTRICTION_BITS of every restriction whose ingredients text mentions"""
+    mask = 0
+    for restriction in find_restrictions(text):
+        mask |= RESTRICTION_BITS[restriction]
+    return mask
+
+
+def exclusion_mask(exclude):
+    """
+    Split excluded names into a mask and the words it does not cover
+    Restriction names (Pork, Beef, ...) and diets (Vegetarian, Halal) set
+    their RESTRICTION_BITS, case-insensitively; any other word is
+    returned for plain text matching.
+    """
+    mask = 0
+    words = []
+    for name in exclude:
+        key = name.strip().lower()
+        if key in _EXCLUSION_BITS:
+            mask |= _EXCLUSION_BITS[key]
+        elif key:
+            words.append(name)
+    return mask, words
+
+
+def _clause_bounds(text, position):
+    # Start and end of the clause containing `position`
+    start = 0
+    end = len(text)
+    for match in _CLAUSE_RE.finditer(text):
+        if match.end() <= position:
+            start = match.end()
+        elif match.start() >= position:
+            end = match.start()
+            break
+    return start, end
+
+
+def _terms(text):
+    # Dish and ingredient mentions in text order. Ingredients inside a
+    # longer dish name ("chicken" in "chicken rice") belong to the dish.
+    dishes = [(match.start(), match.end(), _DISH_LOOKUP[match.group()]) for match in _DISH_RE.finditer(text)]
+    restrictions = {(match.start(), match.end()): _RESTRICTION_LOOKUP[match.group()]
+                    for match in _RESTRICTION_RE.finditer(text)}
+    terms = [_Term(start, end, dish, restrictions.get((start, end))) for start, end, dish in dishes]
+    for (start, end), restriction in restrictions.items():
+        if restriction is not None and not any(s < end and start < e for s, e, _ in dishes):
+            terms.append(_Term(start, end, None, restriction))
+    return sorted(terms)
+
+
+def _negate_nearest(text, terms, order, negated):
+    # Negate the first of `order`, the terms in reading order away from a
+    # negation. An ingredient takes the ingredients listed right next to it
+    # along ("no pork or beef"), but never a dish ("no spicy chicken rice").
+    if not order:
+        return
+    negated.add(order[0])
+    if terms[order[0]].dish is not None:
+        return
+    for previous, index in zip(order, order[1:]):
+        left, right = sorted([terms[previous], terms[index]])
+        gap = _FILLER_RE.sub(' ', text[left.end:right.start])
+        if terms[index].dish is not None or any(char.isalnum() for char in gap):
+            break
+        negated.add(index)
+
+
+def _negated_terms(text, terms):
+    # Indexes of the terms negated by the nearest negation in their clause:
+    # the one before them in English, Malay and Chinese, after them in Tamil
+    negated = set()
+    for match in _NEGATION_BEFORE_RE.finditer(text):
+        _, end = _clause_bounds(text, match.start())
+        order = [i for i, term in enumerate(terms) if match.end() <= term.start and term.end <= end]
+        _negate_nearest(text, terms, order, negated)
+    for match in _NEGATION_AFTER_RE.finditer(text):
+        start, _ = _clause_bounds(text, match.start())
+        order = [i for i, term in enumerate(terms) if start <= term.start and term.end <= match.start()]
+        _negate_nearest(text, terms, order[::-1], negated)
+    return negated
+
+
+def parse_query(text):
+    """
+    Parse a food request in English, Chinese, Malay or Tamil without an LLM
+    Returns a ParsedQuery. Confidence is the share of the request's
+    letters covered by recognised words, so requests with words the
+    lexicons do not know score low.
+    """
+    normalized = _normalize(text)
+    covered = bytearray(len(normalized))
+
+    def cover(match):
+        covered[match.start():match.end()] = b'\x01' * (match.end() - match.start())
+
+    for pattern in (_DISH_RE, _RESTRICTION_RE):
+        for match in pattern.finditer(normalized):
+            cover(match)
+    terms = _terms(normalized)
+    negated = _negated_terms(normalized, terms)
+    dish = next((term.dish for i, term in enumerate(terms) if term.dish and i not in negated), None)
+    exclude = []
+    for i in sorted(negated):
+        if terms[i].restriction is not None and terms[i].restriction not in exclude:
+            exclude.append(terms[i].restriction)
+    for match in _DIET_RE.finditer(normalized):
+        cover(match)
+        for restriction in DIET_RESTRICTIONS[_DIET_LOOKUP[match.group()]]:
+            if restriction not in exclude:
+                exclude.append(restriction)
+
+    max_price = None
+    for pattern in _MAX_PRICE_RES:
+        match = pattern.search(normalized)
+        if match:
+            cover(match)
+            max_price = float(match.group(1))
+            break
+    for match in _CHEAP_RE.finditer(normalized):
+        cover(match)
+        if max_price is None:
+            max_price = CHEAP_PRICE
+
+    for pattern in (_NEGATION_BEFORE_RE, _NEGATION_AFTER_RE, _FILLER_RE):
+        for match in pattern.finditer(normalized):
+            cover(match)
+
+    letters = [i for i, char in enumerate(normalized) if char.isalnum()]
+    confidence = sum(covered[i] for i in letters) / len(letters) if letters else 0.0
+    if dish is None and not exclude and max_price is None:
+        confidence = 0.0
+    return ParsedQuery(dish, max_price, exclude, detect_language(text), round(confidence, 2))
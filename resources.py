@@ -0,0 +1,47 @@
+import streamlit as st
+
+from ai_chatbot import MODEL_NAME, AIChatbot
+from database import Database
+from jobs import JobQueue
+from menu_parser import CACHE_PATH, MenuCache
+
+# Kept in sync with vector_index.VECTOR_INDEX_PATH, which imports numpy
+VECTOR_INDEX_PATH = 'dish_vectors'
+
+# Seconds between progress updates while a menu upload is being read
+PROGRESS_REFRESH_SECONDS = 2
+
+# Heavy objects shared by every session and rerun. Streamlit keeps one
+# instance per distinct set of arguments for the life of the process.
+
+
+@st.cache_resource
+def get_vector_index(path=VECTOR_INDEX_PATH):
+    """Return the dish embedding index stored at path"""
+    # numpy is only loaded once a page needs the database
+    from vector_index import VectorIndex
+    return VectorIndex(path)
+
+
+@st.cache_resource
+def get_database(db_name='grab_helper.db'):
+    """Return the pooled Database for db_name, with its dish embedding index"""
+    return Database.shared(db_name, vector_index=get_vector_index())
+
+
+@st.cache_resource
+def get_chatbot(api_key, model_name=MODEL_NAME):
+    """Return an AIChatbot configured with api_key"""
+    return AIChatbot(api_key, model_name)
+
+
+@st.cache_resource
+def get_menu_cache(path=CACHE_PATH):
+    """Return the parsed-menu cache stored at path"""
+    return MenuCache(path)
+
+
+@st.cache_resource
+def get_job_queue(db_name='grab_helper.db'):
+    """Return the background menu upload queue, starting its worker on first use"""
+    return JobQueue(get_database(db_name), cache=get_menu_cache())
@@ -0,0 +1,78 @@
+"""
+Report how long the app's modules take to import
+
+Each module is imported in a fresh interpreter under `python -X importtime`
+and the self/cumulative times are summarised, so the cost of a cold start
+can be compared before and after a change.
+
+Usage:
+    python startup_timing.py                  # app modules and heavy backends
+    python startup_timing.py menu_parser --top 20
+    python startup_timing.py --json > startup.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Modules imported when an entry point starts, then the heavy backends that
+# should only load when a tab or page needs them
+APP_MODULES = ['query_parser', 'database', 'menu_parser', 'ai_chatbot', 'ui_text', 'resources']
+BACKENDS = ['streamlit', 'pdfplumber', 'pytesseract', 'pdf2image', 'google.generativeai']
+
+
+def time_import(module):
+    """
+    Import a module in a new interpreter and return its timing report
+    {'module', 'ok', 'wall_ms', 'total_ms', 'imports': [(self_ms, cumulative_ms, name), ...]}
+    """
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                             capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    imports = []
+    for line in process.stderr.splitlines():
+        # Lines look like "import time:       412 |       1234 |   module"
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((int(self_us) / 1000, int(cumulative_us) / 1000, name.strip()))
+
+    total_ms = sum(self_ms for self_ms, _, _ in imports)
+    return {
+        'module': module,
+        'ok': process.returncode == 0,
+        'wall_ms': round(wall_ms, 1),
+        'total_ms': round(total_ms, 1),
+        'imports': imports,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('modules', nargs='*', help='modules to time (default: app modules and backends)')
+    parser.add_argument('--top', type=int, default=5, help='slowest imports to list per module')
+    parser.add_argument('--json', action='store_true', help='print the full report as JSON')
+    args = parser.parse_args()
+
+    reports = [time_import(module) for module in (args.modules or APP_MODULES + BACKENDS)]
+    if args.json:
+        print(json.dumps(reports, indent=2))
+        return
+
+    print(f"{'module':<22} {'import ms':>10} {'process ms':>11}")
+    for report in reports:
+        if not report['ok']:
+            print(f"{report['module']:<22} {'failed to import':>22}")
+            continue
+        print(f"{report['module']:<22} {report['total_ms']:>10.1f} {report['wall_ms']:>11.1f}")
+        slowest = sorted(report['imports'], key=lambda item: item[0], reverse=True)[:args.top]
+        for self_ms, _, name in slowest:
+            print(f"    {name:<36} {self_ms:>8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
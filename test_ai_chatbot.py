@@ -0,0 +1,97 @@
+import asyncio
+import time
+import types
+
+import pytest
+
+from ai_chatbot import AIChatbot, AsyncGeminiClient, CircuitBreaker, ModelUnavailable, ResponseCache, TokenBucket
+
+
+class FullLimiter:
+    """Rate limiter whose queue is always full"""
+
+    def reserve(self, max_wait=None):
+        raise ModelUnavailable('Too many requests are waiting for the model')
+
+
+class Model:
+    def __init__(self, delay=0):
+        self.delay = delay
+
+    async def generate_content_async(self, prompt, **kwargs):
+        await asyncio.sleep(self.delay)
+        return types.SimpleNamespace(text='ok')
+
+
+class RejectingModel:
+    """Model that refuses every request with an error that is not retried"""
+
+    async def generate_content_async(self, prompt, **kwargs):
+        raise ValueError('API key not valid')
+
+
+def open_breaker():
+    breaker = CircuitBreaker(failures=1, reset_after=0.05)
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    time.sleep(0.06)
+    assert breaker.state == 'half-open'
+    return breaker
+
+
+def test_half_open_trial_closes_circuit():
+    breaker = open_breaker()
+    client = AsyncGeminiClient(Model(), limiter=TokenBucket(10 ** 9, 10 ** 9), breaker=breaker)
+    assert client.generate('hi') == 'ok'
+    assert breaker.state == 'closed'
+
+
+def test_half_open_allows_one_trial():
+    breaker = open_breaker()
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+
+
+def test_rate_limited_trial_releases_slot():
+    breaker = open_breaker()
+    client = AsyncGeminiClient(Model(), limiter=FullLimiter(), breaker=breaker)
+    with pytest.raises(ModelUnavailable):
+        client.before_attempt()
+    assert breaker.allow()
+
+
+def test_cancelled_trial_releases_slot():
+    breaker = open_breaker()
+    client = AsyncGeminiClient(Model(delay=10), limiter=TokenBucket(10 ** 9, 10 ** 9), breaker=breaker)
+    future = asyncio.run_coroutine_threadsafe(client._request('hi'), client._loop)
+    time.sleep(0.05)
+    future.cancel()
+    time.sleep(0.05)
+    assert breaker.allow()
+
+
+def test_parse_request_falls_back_to_local_parse():
+    # AIChatbot.__init__ needs the Gemini SDK; only the client is used here
+    chatbot = AIChatbot.__new__(AIChatbot)
+    chatbot.model_name = 'test'
+    chatbot.cache = ResponseCache()
+    chatbot.client = AsyncGeminiClient(RejectingModel(), limiter=TokenBucket(10 ** 9, 10 ** 9))
+    parsed = chatbot.parse_request('saya nak makan sesuatu yang sedap')
+    assert parsed.language == 'malay'
+    assert parsed.dish is None
+
+
+def test_response_cache_sweeps_disk_tier(tmp_path):
+    cache = ResponseCache(db_path=str(tmp_path / 'cache.db'), max_disk_entries=3, sweep_every=2)
+    cache.put('expired', 'old', ttl=-1)
+    for i in range(5):
+        cache.put(f'key{i}', 'text', ttl=60 + i)
+    conn = cache._connect()
+    try:
+        keys = [row[0] for row in conn.execute('SELECT key FROM response_cache ORDER BY key')]
+    finally:
+        conn.close()
+    # The last sweep ran on the sixth write
+    assert keys == ['key2', 'key3', 'key4']
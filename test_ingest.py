@@ -0,0 +1,27 @@
+import os
+
+import pytest
+
+from ingest import check_duplicates, find_menus
+
+
+def touch(*parts):
+    os.makedirs(os.path.dirname(os.path.join(*parts)), exist_ok=True)
+    open(os.path.join(*parts), 'w').close()
+
+
+def test_find_menus_names_files_after_their_directory_when_names_clash(tmp_path):
+    touch(tmp_path, 'chicken_rice_stall.pdf')
+    touch(tmp_path, 'stall_a', 'menu.pdf')
+    touch(tmp_path, 'stall-b', 'Menu.PDF')
+    names = {os.path.relpath(path, tmp_path): restaurant for path, restaurant, _, _ in find_menus(str(tmp_path))}
+    assert names == {'chicken_rice_stall.pdf': 'Chicken Rice Stall',
+                     os.path.join('stall_a', 'menu.pdf'): 'Stall A Menu',
+                     os.path.join('stall-b', 'Menu.PDF'): 'Stall B Menu'}
+    check_duplicates(find_menus(str(tmp_path)))
+
+
+def test_check_duplicates():
+    check_duplicates([('a.pdf', 'Stall', 'Bedok', None), ('b.pdf', 'Stall', 'Toa Payoh', None)])
+    with pytest.raises(ValueError):
+        check_duplicates([('a.pdf', 'Stall', 'Bedok', None), ('b.pdf', 'Stall', 'Bedok', 4.5)])
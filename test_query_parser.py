@@ -0,0 +1,65 @@
+from dietary import filter_dishes
+from query_parser import RESTRICTION_BITS, exclusion_mask, parse_query, restriction_mask
+
+
+def bits(*names):
+    return sum(RESTRICTION_BITS[name] for name in names)
+
+
+def test_restriction_mask_meat():
+    for name in ['Chicken Rice', 'Mutton Soup', 'Satay', 'Duck Rice', 'Nasi Ayam', '鸡饭', '烧鸭', 'கோழி சோறு']:
+        assert restriction_mask(name) & bits('Meat'), name
+
+
+def test_restriction_mask_compound_words():
+    assert restriction_mask('Fishball Noodles') == bits('Seafood')
+    assert restriction_mask('Porkchop Rice') == bits('Pork')
+    assert restriction_mask('Creamy Mushroom Soup') == bits('Dairy')
+
+
+def test_restriction_mask_ignores_lookalikes():
+    for name in ['Egg Fried Rice', '鸡蛋炒饭', 'Coconut Rice', 'Nutritious Salad', 'Hamburger Bun']:
+        assert restriction_mask(name) == 0, name
+
+
+def test_exclusion_mask():
+    assert exclusion_mask(['Vegetarian']) == (bits('Pork', 'Beef', 'Seafood', 'Meat'), [])
+    assert exclusion_mask(['halal', 'Nuts']) == (bits('Pork', 'Nuts'), [])
+    assert exclusion_mask(['Pork', 'durian', ' ']) == (bits('Pork'), ['durian'])
+
+
+def test_filter_dishes_vegetarian():
+    dishes = [{'name': name} for name in ['Chicken Rice', 'Mutton Soup', 'Satay', 'Fishball Noodles',
+                                          'Char Siew Rice', 'Vegetable Fried Rice', 'Egg Fried Rice']]
+    kept = filter_dishes(dishes, ['Vegetarian'])
+    assert [dish['name'] for dish in kept] == ['Vegetable Fried Rice', 'Egg Fried Rice']
+
+
+def test_filter_dishes_words_and_descriptions():
+    dishes = [{'name': 'Mee Goreng', 'description': 'with prawns'}, {'name': 'Durian Pancake'},
+              {'name': 'Plain Prata'}]
+    kept = filter_dishes(dishes, ['Seafood', 'durian'])
+    assert [dish['name'] for dish in kept] == ['Plain Prata']
+
+
+def test_parse_query_english():
+    assert parse_query('chicken rice without pork and beef under $6')[:4] == \
+        ('chicken rice', 6.0, ['Pork', 'Beef'], 'english')
+    assert parse_query('no spicy chicken rice')[:3] == ('chicken rice', None, ['Spicy'])
+    assert parse_query('not chicken rice, give me laksa')[:3] == ('laksa', None, [])
+
+
+def test_parse_query_chinese():
+    assert parse_query('我想吃鸡饭，不要猪肉，10块以下')[:4] == ('chicken rice', 10.0, ['Pork'], 'chinese')
+    assert parse_query('不要猪肉的鸡饭')[:3] == ('chicken rice', None, ['Pork'])
+
+
+def test_parse_query_malay():
+    assert parse_query('saya nak nasi lemak tanpa udang bawah 5')[:4] == ('nasi lemak', 5.0, ['Seafood'], 'malay')
+    assert parse_query('nasi ayam tanpa pedas')[:3] == ('chicken rice', None, ['Spicy'])
+
+
+def test_parse_query_tamil():
+    # The negation follows the ingredient and must not reach the dish before it
+    assert parse_query('சிக்கன் ரைஸ் பன்றி இல்லாமல்')[:4] == ('chicken rice', None, ['Pork'], 'tamil')
+    assert parse_query('பன்றி இறைச்சி இல்லாமல் சிக்கன் ரைஸ்')[:3] == ('chicken rice', None, ['Pork'])
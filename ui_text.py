@@ -0,0 +1,76 @@
+# Static UI text, built once per process instead of on every Streamlit rerun
+
+# Language translations
+TRANSLATIONS = {
+    'English': {
+        'title': 'GRAB Senior Helper - Find Food & Restaurants',
+        'language': 'Language',
+        'api_key': 'Enter Google API Key',
+        'upload_menu': 'Upload Restaurant Menu (PDF)',
+        'dietary': 'Dietary Restrictions',
+        'price_range': 'Price Range',
+        'search': 'Search',
+        'chat': 'Chat with Assistant',
+        'results': 'Search Results',
+        'ai_unavailable': 'Sorry, our assistant is busy right now. Please try again in a minute.'
+    },
+    'Chinese': {
+        'title': 'GRAB 老年人助手 - 查找食物和餐厅',
+        'language': '语言',
+        'api_key': '输入 Google API 密钥',
+        'upload_menu': '上传餐厅菜单 (PDF)',
+        'dietary': '饮食限制',
+        'price_range': '价格范围',
+        'search': '搜索',
+        'chat': '与助手聊天',
+        'results': '搜索结果',
+        'ai_unavailable': '抱歉，助手现在很忙。请过一分钟再试。'
+    },
+    'Malay': {
+        'title': 'GRAB Pembantu Warga Tua - Cari Makanan & Restoran',
+        'language': 'Bahasa',
+        'api_key': 'Masukkan Kunci API Google',
+        'upload_menu': 'Muat Naik Menu Restoran (PDF)',
+        'dietary': 'Sekatan Pemakanan',
+        'price_range': 'Julat Harga',
+        'search': 'Cari',
+        'chat': 'Berbual dengan Pembantu',
+        'results': 'Hasil Carian',
+        'ai_unavailable': 'Maaf, pembantu kami sibuk sekarang. Sila cuba lagi sebentar lagi.'
+    },
+    'Tamil': {
+        'title': 'GRAB மூத்த குடிமக்கள் உதவி - உணவு மற்றும் உணவகங்களைத் தேடுங்கள்',
+        'language': 'மொழி',
+        'api_key': 'Google API விசையை உள்ளிடவும்',
+        'upload_menu': 'உணவகத்தின் மெனு பதிவேற்றவும் (PDF)',
+        'dietary': 'உணவு கட்டுப்பாடுகள்',
+        'price_range': 'விலை வரம்பு',
+        'search': 'தேடு',
+        'chat': 'உதவியாளருடன் சேவையளிக்கவும்',
+        'results': 'தேடல் முடிவுகள்',
+        'ai_unavailable': 'மன்னிக்கவும், எங்கள் உதவியாளர் இப்போது மும்முரமாக உள்ளார். ஒரு நிமிடம் கழித்து மீண்டும் முயற்சிக்கவும்.'
+    }
+}
+
+# Language support
+LANGUAGES = {
+    'English': 'english',
+    '中文 (Chinese)': 'chinese',
+    'Bahasa Melayu': 'malay',
+    'தமிழ் (Tamil)': 'tamil'
+}
+
+# Custom CSS for larger text
+LARGE_TEXT_CSS = """
+    <style>
+    html, body, [class*="st-"] {
+        font-size: 20px;
+    }
+    h1 {
+        font-size: 48px;
+    }
+    h2 {
+        font-size: 36px;
+    }
+    </style>
+    """
@@ -0,0 +1,395 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+
+import metrics
+from query_parser import find_dishes, find_restrictions
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: writes are only serialized within a process
+    fcntl = None
+
+VECTOR_INDEX_PATH = 'dish_vectors'
+
+# Dimensions of the hashing embedder; 256 float32s is 1 KB per dish
+HASHING_DIM = 256
+
+# Embedder of the dish index: a sentence-transformers model name, or
+# 'hashing' for the offline HashingEmbedder. Unset, the model below is used
+# when sentence-transformers is installed and the hashing embedder otherwise.
+EMBEDDER_ENV = 'DISH_EMBEDDER'
+DEFAULT_MODEL = 'paraphrase-multilingual-MiniLM-L12-v2'
+
+# Rows multiplied per batch, bounding the temporary score arrays
+BATCH_ROWS = 65536
+
+# Default number of dishes returned by a search
+SEARCH_K = 20
+
+# Everyday descriptions -> words that appear on menus, so that "something
+# soft for when I'm sick" lands near porridge and soups
+CONCEPTS = {
+    'soft': ['soft', 'easy to chew', 'tender', 'no teeth', 'porridge', 'congee', 'steamed', 'tofu', 'beancurd',
+             'egg', 'mee sua', 'bee hoon', 'noodles', 'soup'],
+    'sick': ['sick', 'unwell', 'cold', 'flu', 'fever', 'sore throat', 'recover', 'soup', 'porridge', 'congee',
+             'herbal', 'ginger', 'broth', 'double boiled'],
+    'light': ['light', 'healthy', 'not oily', 'less oil', 'diet', 'steamed', 'boiled', 'clear', 'vegetables',
+              'salad', 'soup'],
+    'hearty': ['hearty', 'filling', 'hungry', 'big', 'briyani', 'nasi lemak', 'curry', 'fried', 'rice'],
+    'sweet': ['sweet', 'dessert', 'kueh', 'cake', 'chendol', 'pudding', 'ice kacang', 'tau suan', 'bubur'],
+    'drink': ['drink', 'thirsty', 'kopi', 'teh', 'coffee', 'tea', 'juice', 'milo', 'bandung', 'barley'],
+}
+
+# Times a reader retries when a writer swaps the index while it is loading
+REFRESH_RETRIES = 5
+
+# The matrix is rewritten without superseded rows and tombstones once they
+# are this share of its rows, and at least COMPACT_MIN_ROWS of them
+COMPACT_DEAD_SHARE = 0.3
+COMPACT_MIN_ROWS = 1000
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r'\w+')
+_VERSION_RE = re.compile(r'-(\d+)\.(?:npy|i64|f32)$')
+_CONCEPT_RES = {
+    concept: re.compile('|'.join(r'\b' + re.escape(term) + r'\b' for term in sorted(terms, key=len, reverse=True)))
+    for concept, terms in CONCEPTS.items()
+}
+
+
+def dish_text(dish):
+    """Text embedded for a dish dict: its name and description"""
+    return f"{dish['name']} {dish.get('description') or ''}".strip()
+
+
+class HashingEmbedder:
+    """
+    Offline embedder: hashed words, word pairs, character trigrams and
+    concept tags, so related menus and requests share dimensions
+    Dish names in Chinese, Malay and Tamil are tagged with their English
+    keyword from query_parser. Needs no model download, so it suits tests
+    and machines without network access.
+    """
+
+    def __init__(self, dim=HASHING_DIM):
+        self.dim = dim
+        self.name = f'hashing-{dim}'
+
+    def _features(self, text):
+        normalized = text.lower()
+        words = _WORD_RE.findall(normalized)
+        features = [(word, 1.0) for word in words]
+        features += [(f'{a} {b}', 1.0) for a, b in zip(words, words[1:])]
+        for word in words:
+            padded = f' {word} '
+            features += [(padded[i:i + 3], 0.3) for i in range(len(padded) - 2)]
+        features += [(f'dish:{dish}', 2.0) for dish in find_dishes(text)]
+        features += [(f'ingredient:{name}', 1.0) for name in find_restrictions(text)]
+        features += [(f'concept:{concept}', 1.5) for concept, pattern in _CONCEPT_RES.items()
+                     if pattern.search(normalized)]
+        return features
+
+    def embed(self, texts):
+        """Return a (len(texts), dim) float32 matrix of unit vectors"""
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                digest = zlib.crc32(feature.encode('utf-8'))
+                # The top bit picks a sign so colliding features cancel out on average
+                vectors[row, digest % self.dim] += weight if digest & 0x80000000 else -weight
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+class SentenceTransformerEmbedder:
+    """
+    A local sentence-transformers model, e.g. a multilingual MiniLM
+    Loaded on first use; install sentence-transformers to use it.
+    """
+
+    def __init__(self, model_name=DEFAULT_MODEL):
+        self.model_name = model_name
+        self.name = f'sentence-transformers:{model_name}'
+        self._model = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    @property
+    def dim(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts):
+        return self.model.encode(list(texts), normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+
+def default_embedder():
+    """
+    Return the embedder named by the DISH_EMBEDDER environment variable
+    A local sentence-transformers model is used when the package is
+    installed and the model loads; otherwise the hashing embedder, whose
+    matches are rougher.
+    """
+    name = os.getenv(EMBEDDER_ENV, '')
+    if name == 'hashing':
+        return HashingEmbedder()
+    try:
+        embedder = SentenceTransformerEmbedder(name or DEFAULT_MODEL)
+        embedder.model
+    except ImportError:
+        if name:
+            raise
+        return HashingEmbedder()
+    except Exception:
+        if name:
+            raise
+        # e.g. no network to download the model; search still works
+        logger.warning('Could not load %s, using the hashing embedder', DEFAULT_MODEL, exc_info=True)
+        return HashingEmbedder()
+    return embedder
+
+
+def _top_k(scores, k):
+    # Indexes of the k highest scores, best first
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind='stable')]
+
+
+def _scores(vectors, queries):
+    # vectors @ queries.T, a batch of rows at a time so a memory-mapped
+    # matrix is streamed rather than copied whole
+    scores = np.empty((len(vectors), queries.shape[0]), dtype=np.float32)
+    for start in range(0, len(vectors), BATCH_ROWS):
+        scores[start:start + BATCH_ROWS] = vectors[start:start + BATCH_ROWS] @ queries.T
+    return scores
+
+
+def rank_dishes(query, dishes, k=SEARCH_K, embedder=None, min_price=None, max_price=None):
+    """
+    Return the k dishes (dicts with 'name', 'price', ...) most similar to a query
+    Dishes outside the price range are dropped first. Input order breaks ties.
+    """
+    dishes = [dish for dish in dishes
+              if (min_price is None or dish['price'] >= min_price)
+              and (max_price is None or dish['price'] <= max_price)]
+    if len(dishes) <= k:
+        return dishes
+    embedder = embedder or HashingEmbedder()
+    vectors = embedder.embed([dish_text(dish) for dish in dishes])
+    scores = _scores(vectors, embedder.embed([query]))[:, 0]
+    return [dishes[i] for i in _top_k(scores, k)]
+
+
+def _current_rows(rows):
+    # Indexes of the rows holding each dish's current vector: its last row,
+    # unless that is a tombstone (~id)
+    keys = np.where(rows < 0, ~rows, rows)
+    _, last = np.unique(keys[::-1], return_index=True)
+    current = np.sort(len(rows) - 1 - last)
+    return current[rows[current] >= 0]
+
+
+class VectorIndex:
+    """
+    Dish embeddings stored as one contiguous float32 matrix on disk
+    `path` is a directory holding the matrix (one row per dish, memory-
+    mapped for searching), the matching dish ids and meta.json. Writes
+    append rows: an upserted dish gets a new row that supersedes its old
+    one and a removed dish a tombstone row, and meta.json, which holds
+    the row count readers may use, is swapped last. Readers in other
+    processes therefore never see a half-written index and pick up new
+    rows on their next search. Once superseded rows make up a large
+    share of the matrix it is compacted into new files. Writers in
+    different processes take turns through a lock file in the directory.
+    """
+
+    def __init__(self, path=VECTOR_INDEX_PATH, embedder=None):
+        self.path = path
+        self.embedder = embedder or default_embedder()
+        self._lock = threading.Lock()
+        self._meta_mtime = None
+        self._meta = None
+        self._version = 0
+        self._rows = np.empty(0, dtype=np.int64)  # stored id of every row, ~id for tombstones
+        self._live = np.empty(0, dtype=np.int64)  # rows holding each dish's current vector
+        self._ids = np.empty(0, dtype=np.int64)
+        self._vectors = np.empty((0, self.embedder.dim), dtype=np.float32)
+        os.makedirs(path, exist_ok=True)
+        self._refresh()
+
+    def _meta_path(self):
+        return os.path.join(self.path, 'meta.json')
+
+    @contextmanager
+    def _write_lock(self):
+        # Serializes read-modify-write between threads and between processes
+        # sharing the directory, so no writer drops another's rows
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.path, '.lock'), 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        # Reload if another process (or an earlier write) changed the index.
+        # A writer may compact the index and delete the files meta.json
+        # named between reading it and loading them; the new meta.json is
+        # read then.
+        for attempt in range(REFRESH_RETRIES):
+            try:
+                return self._load()
+            except FileNotFoundError:
+                if attempt == REFRESH_RETRIES - 1:
+                    raise
+
+    def _load(self):
+        try:
+            mtime = os.stat(self._meta_path()).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._meta_mtime:
+            return
+        with open(self._meta_path()) as f:
+            meta = json.load(f)
+        version = int(_VERSION_RE.search(meta['vectors']).group(1))
+        dim = self.embedder.dim
+        if meta['embedder'] != self.embedder.name:
+            # Vectors from another model are not comparable; start over
+            rows = np.empty(0, dtype=np.int64)
+            vectors = np.empty((0, dim), dtype=np.float32)
+        elif 'rows' not in meta:
+            # Written before rows were appended: whole .npy files
+            rows = np.load(os.path.join(self.path, meta['ids']))
+            vectors = np.load(os.path.join(self.path, meta['vectors']), mmap_mode='r')
+        else:
+            count = meta['rows']
+            rows = np.fromfile(os.path.join(self.path, meta['ids']), dtype=np.int64, count=count)
+            vectors = (np.memmap(os.path.join(self.path, meta['vectors']), dtype=np.float32, mode='r',
+                                 shape=(count, dim)) if count else np.empty((0, dim), dtype=np.float32))
+        live = _current_rows(rows)
+        self._meta_mtime, self._meta, self._version = mtime, meta, version
+        self._rows, self._live, self._ids, self._vectors = rows, live, rows[live], vectors
+
+    def _append(self, ids, vectors):
+        # Called with the write lock held, after _refresh. Rows go after the
+        # count in meta.json, overwriting anything a failed writer left there.
+        meta = self._meta
+        if meta is None or 'rows' not in meta or meta['embedder'] != self.embedder.name:
+            return self._compact(ids, vectors)
+        count = meta['rows']
+        for name, data in ((meta['ids'], ids), (meta['vectors'], vectors)):
+            with open(os.path.join(self.path, name), 'r+b') as f:
+                f.seek(count * data[:1].nbytes)
+                f.write(data.tobytes())
+                f.truncate()
+        self._write_meta(dict(meta, rows=count + len(ids)))
+        dead = len(self._rows) - len(self._live)
+        if dead >= max(COMPACT_MIN_ROWS, len(self._rows) * COMPACT_DEAD_SHARE):
+            self._compact()
+
+    def _write_meta(self, meta):
+        tmp = self._meta_path() + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._meta_path())
+        self._refresh()
+
+    def _compact(self, ids=None, vectors=None):
+        # Rewrite the current rows, plus any new ones, into new files without
+        # superseded rows and tombstones
+        rows, matrix = self._ids, np.asarray(self._vectors[self._live], dtype=np.float32)
+        if ids is not None:
+            rows, matrix = np.concatenate([rows, ids]), np.concatenate([matrix, vectors])
+            keep = _current_rows(rows)
+            rows, matrix = rows[keep], matrix[keep]
+
+        replaced = self._version
+        version = max(time.time_ns(), replaced + 1)
+        names = {'ids': f'ids-{version}.i64', 'vectors': f'vectors-{version}.f32'}
+        rows.astype(np.int64).tofile(os.path.join(self.path, names['ids']))
+        np.ascontiguousarray(matrix, dtype=np.float32).tofile(os.path.join(self.path, names['vectors']))
+        self._write_meta(dict(names, embedder=self.embedder.name, dim=self.embedder.dim, rows=len(rows)))
+        # Readers that loaded the replaced meta.json may still be opening its
+        # files, so only versions before it are deleted. Mapped files stay
+        # readable; where the OS refuses to delete them, a later write will.
+        for name in os.listdir(self.path):
+            match = _VERSION_RE.search(name)
+            if match and int(match.group(1)) < replaced:
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._ids)
+
+    def ids(self):
+        """Return the ids of every indexed dish"""
+        with self._lock:
+            self._refresh()
+            return self._ids.copy()
+
+    def upsert(self, ids, texts):
+        """Embed texts and store them under ids, replacing existing rows"""
+        if not len(ids):
+            return
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = self.embedder.embed(texts).astype(np.float32)
+        with self._write_lock():
+            self._refresh()
+            self._append(ids, vectors)
+
+    def remove(self, ids):
+        """Drop the rows of ids"""
+        if not len(ids):
+            return
+        with self._write_lock():
+            self._refresh()
+            ids = np.intersect1d(self._ids, np.asarray(ids, dtype=np.int64))
+            if len(ids):
+                self._append(~ids, np.zeros((len(ids), self.embedder.dim), dtype=np.float32))
+
+    def search(self, query, k=SEARCH_K):
+        """Return [(dish_id, score), ...] for the k dishes most similar to query, best first"""
+        return self.search_many([query], k)[0]
+
+    def search_many(self, queries, k=SEARCH_K):
+        """Search several queries with one batched matrix product"""
+        with self._lock:
+            self._refresh()
+            ids, live, vectors = self._ids, self._live, self._vectors
+        with metrics.timer('vector_search'):
+            # Superseded rows are scored too, which is cheaper than copying
+            # the current ones out of the memory-mapped matrix
+            scores = _scores(vectors, self.embedder.embed(queries))
+            if len(live) != len(vectors):
+                scores = scores[live]
+            results = []
+            for column in range(len(queries)):
+                top = _top_k(scores[:, column], k)
+                results.append([(int(ids[i]), float(scores[i, column])) for i in top])
+        return results